@@ -0,0 +1,102 @@
+"""
+chapter03/pico/benchmarks/file_streaming_benchmark.py
+
+Measure the heap allocations made while Microdot streams a file body, using
+readinto() with a reused buffer (the default for files) versus allocating a
+new bytes object for every read() (the previous behaviour, still used for
+streams without readinto()).
+
+For both interpreters the number of chunk buffers that were allocated, and
+their total size, is reported. Under MicroPython the garbage collector is
+also disabled while the file is served, so gc.mem_alloc() reports the exact
+number of heap bytes allocated.
+
+Run from the chapter03/pico folder with CPython:
+
+$ python3 benchmarks/file_streaming_benchmark.py
+
+or with MicroPython on the Pico:
+
+$ mpremote mount . run benchmarks/file_streaming_benchmark.py
+"""
+import asyncio
+import gc
+import sys
+
+sys.path.insert(0, '.')
+
+from microdot.microdot import Response  # noqa: E402
+
+FILES = ['templates/index_api_client.html', 'static/jquery.min.js']
+BUFFER_SIZES = [512, 1024, 4096]
+
+
+class NullStream:
+    """ Output stream that records the chunks written to it. """
+
+    def __init__(self):
+        self.chunks = 0
+        self.buffers = 0
+        self.buffer_bytes = 0
+        self.last = None
+
+    async def awrite(self, data):
+        self.chunks += 1
+        # a reused buffer is written as the same memoryview (or a slice of
+        # it for the final chunk), a new allocation is a different object
+        if data is not self.last and not (
+                isinstance(data, memoryview) and
+                isinstance(self.last, memoryview) and len(data) < len(self.last)):
+            self.buffers += 1
+            self.buffer_bytes += len(data)
+            self.last = data
+
+
+class ReadOnlyFile:
+    """ File wrapper without readinto(), to force the read() code path. """
+
+    def __init__(self, f):
+        self.f = f
+
+    def read(self, n):
+        return self.f.read(n)
+
+    def close(self):
+        self.f.close()
+
+
+async def serve(filename, read_only):
+    f = open(filename, 'rb')
+    response = Response(body=ReadOnlyFile(f) if read_only else f)
+    stream = NullStream()
+
+    gc.collect()
+    if hasattr(gc, 'mem_alloc'):
+        gc.disable()
+        before = gc.mem_alloc()
+    await response.write_body(stream)
+    if hasattr(gc, 'mem_alloc'):
+        allocated = gc.mem_alloc() - before
+        gc.enable()
+    else:
+        allocated = None
+    return stream.chunks, stream.buffers, stream.buffer_bytes, allocated
+
+
+async def main():
+    print('{:<33} {:>6} {:<9} {:>7} {:>8} {:>13} {:>11}'.format(
+        'file', 'buffer', 'path', 'chunks', 'buffers', 'buffer bytes',
+        'heap bytes'))
+    for filename in FILES:
+        for buffer_size in BUFFER_SIZES:
+            Response.send_file_buffer_size = buffer_size
+            for read_only in (True, False):
+                chunks, buffers, buffer_bytes, allocated = await serve(
+                    filename, read_only)
+                print('{:<33} {:>6} {:<9} {:>7} {:>8} {:>13} {:>11}'.format(
+                    filename, buffer_size,
+                    'read' if read_only else 'readinto', chunks, buffers,
+                    buffer_bytes, 'n/a' if allocated is None else allocated))
+
+
+asyncio.run(main())
@@ -0,0 +1,190 @@
+"""
+chapter03/pico/benchmarks/gc_pool_benchmark.py
+
+Measure garbage collections and the worst garbage collection pause per 1000
+requests handled by Microdot, with and without reusing Request and Response
+objects (Request.pool_size and Response.pool_size).
+
+Requests are fed to Microdot from memory, over persistent connections, so no
+network is needed. The workload mixes the requests a web page makes to the
+Chapter 3 API server: GET /led and POST /led with a JSON body.
+
+Under CPython, collections and their exact duration are reported through
+gc.callbacks. CPython frees most objects as soon as they are no longer used,
+through reference counting, so it rarely needs to collect and the figures
+that matter are those measured on the Pico. MicroPython does not report
+collections, so a collection is detected when gc.mem_alloc() drops during a
+request, and the pause is estimated as the time of that request minus the
+median request time.
+
+Run from the chapter03/pico folder with CPython:
+
+$ python3 benchmarks/gc_pool_benchmark.py
+
+or with MicroPython on the Pico:
+
+$ mpremote mount . run benchmarks/gc_pool_benchmark.py
+"""
+import asyncio
+import gc
+import sys
+import time
+
+sys.path.insert(0, '.')
+
+from microdot.microdot import Microdot, Request, Response  # noqa: E402
+
+REQUESTS = 1000
+PER_CONNECTION = 100
+POOL_SIZES = [0, 4]
+
+GET = b'GET /led HTTP/1.1\r\nHost: pico\r\nAccept: application/json\r\n\r\n'
+POST = (b'POST /led HTTP/1.1\r\nHost: pico\r\n'
+        b'Content-Type: application/json\r\nContent-Length: 13\r\n\r\n'
+        b'{"level": 42}')
+
+try:
+    ticks_us = time.ticks_us
+    ticks_diff = time.ticks_diff
+except AttributeError:
+    def ticks_us():
+        return int(time.perf_counter() * 1000000)
+
+    def ticks_diff(end, start):
+        return end - start
+
+
+class Reader:
+    """ Input stream that returns a number of requests, then EOF. """
+
+    def __init__(self, count):
+        self.count = count
+        self.data = b''
+
+    def next_request(self):
+        if not self.data and self.count:
+            self.data = GET if self.count % 2 else POST
+            self.count -= 1
+
+    async def readline(self):
+        self.next_request()
+        i = self.data.find(b'\n') + 1 or len(self.data)
+        line, self.data = self.data[:i], self.data[i:]
+        return line
+
+    async def readexactly(self, n):
+        data, self.data = self.data[:n], self.data[n:]
+        return data
+
+    async def read(self, n=-1):
+        return await self.readexactly(len(self.data) if n < 0 else n)
+
+
+class Writer:
+    """ Output stream that discards the data and times each request. """
+
+    def __init__(self, stats):
+        self.stats = stats
+
+    async def awrite(self, data):
+        self.stats.response_written()
+
+    async def aclose(self):
+        pass
+
+    def get_extra_info(self, name):
+        return ('127.0.0.1', 5000)
+
+
+class Stats:
+    """ Collection counts and pauses, measured per request. """
+
+    def __init__(self):
+        self.collections = 0
+        self.pauses = []
+        self.times = []
+        self.gc_start = None
+        self.start = ticks_us()
+        self.alloc = gc.mem_alloc() if hasattr(gc, 'mem_alloc') else None
+
+    def gc_callback(self, phase, info):
+        # CPython only
+        if phase == 'start':
+            self.gc_start = time.perf_counter()
+        elif self.gc_start is not None:
+            self.collections += 1
+            self.pauses.append((time.perf_counter() - self.gc_start) * 1e6)
+
+    def response_written(self):
+        now = ticks_us()
+        elapsed = ticks_diff(now, self.start)
+        self.start = now
+        if self.alloc is not None:
+            alloc = gc.mem_alloc()
+            collected = alloc < self.alloc
+            self.alloc = alloc
+            self.times.append((elapsed, collected))
+
+    def worst_pause(self):
+        if self.alloc is None:
+            return max(self.pauses) if self.pauses else 0
+        # MicroPython: estimate the pause from the slowest requests
+        times = sorted(elapsed for elapsed, collected in self.times)
+        median = times[len(times) // 2]
+        self.collections = 0
+        worst = 0
+        for elapsed, collected in self.times:
+            if collected:
+                self.collections += 1
+                worst = max(worst, elapsed - median)
+        return worst
+
+
+def make_app():
+    app = Microdot()
+    state = {'level': 50, 'gpio': 21}
+
+    @app.get('/led')
+    async def led_get(request):
+        return state
+
+    @app.post('/led')
+    async def led_post(request):
+        state['level'] = int(request.json['level'])
+        return state
+
+    return app
+
+
+async def run(app, pool_size):
+    Request.pool_size = Response.pool_size = pool_size
+    del Request._pool[:]
+    del Response._pool[:]
+    gc.collect()
+    stats = Stats()
+    if hasattr(gc, 'callbacks'):
+        gc.callbacks.append(stats.gc_callback)
+    start = ticks_us()
+    try:
+        for _ in range(REQUESTS // PER_CONNECTION):
+            await app.handle_request(Reader(PER_CONNECTION), Writer(stats))
+    finally:
+        if hasattr(gc, 'callbacks'):
+            gc.callbacks.remove(stats.gc_callback)
+    elapsed = ticks_diff(ticks_us(), start)
+    worst = stats.worst_pause()
+    return stats.collections, worst, elapsed / REQUESTS
+
+
+async def main():
+    app = make_app()
+    await run(app, 0)  # warm up
+    print('{:>9} {:>12} {:>16} {:>14}'.format(
+        'pool size', 'collections', 'worst pause us', 'us/request'))
+    for pool_size in POOL_SIZES:
+        collections, worst, usecs = await run(app, pool_size)
+        print('{:>9} {:>12} {:>16.0f} {:>14.1f}'.format(
+            pool_size, collections, worst, usecs))
+
+
+asyncio.run(main())
@@ -0,0 +1,101 @@
+"""
+chapter03/pico/benchmarks/response_write_benchmark.py
+
+Compare how many stream writes Microdot's Response.write needs per response,
+against the previous approach of writing the status line, each header and
+the blank line separately.
+
+Each stream write becomes a send() system call on CPython, and on the Pico W
+usually a separate TCP segment, so fewer writes per response means fewer
+syscalls and fewer packets over WiFi.
+
+Run with CPython from the chapter03/pico folder:
+
+$ python3 benchmarks/response_write_benchmark.py
+"""
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from microdot.microdot import Response  # noqa: E402
+
+ITERATIONS = 2000
+
+
+class CountingStream:
+    """ Output stream that records the number and size of writes. """
+
+    def __init__(self):
+        self.writes = 0
+        self.bytes = 0
+
+    async def awrite(self, data):
+        self.writes += 1
+        self.bytes += len(data)
+
+
+async def write_per_line(response, stream):
+    """ Previous Response.write behaviour, one write per header line. """
+
+    response.complete()
+    reason = response.reason if response.reason is not None else \
+        ('OK' if response.status_code == 200 else 'N/A')
+    await stream.awrite('HTTP/{} {} {}\r\n'.format(
+        response.http_version, response.status_code, reason).encode())
+    for header, value in response.headers.items():
+        values = value if isinstance(value, list) else [value]
+        for value in values:
+            await stream.awrite('{}: {}\r\n'.format(header, value).encode())
+    await stream.awrite(b'\r\n')
+    if not response.is_head:
+        await response.write_body(stream)
+
+
+def json_response():
+    return Response({'level': 50, 'gpio': 21})
+
+
+def error_response():
+    return Response('Not found', 404)
+
+
+def file_response():
+    return Response.send_file(
+        os.path.join(os.path.dirname(__file__), '..', 'templates',
+                     'index_api_client.html'), max_age=86400)
+
+
+async def measure(make_response, write):
+    stream = CountingStream()
+    start = time.perf_counter()
+    for _ in range(ITERATIONS):
+        await write(make_response(), stream)
+    elapsed = time.perf_counter() - start
+    return (stream.writes / ITERATIONS, stream.bytes / ITERATIONS,
+            elapsed / ITERATIONS * 1e6)
+
+
+async def main():
+    workloads = [
+        ('JSON state', json_response),
+        ('404 error', error_response),
+        ('static file', file_response),
+    ]
+    writers = [
+        ('per-line', write_per_line),
+        ('single buffer', lambda response, stream: response.write(stream)),
+    ]
+
+    print('{:<12} {:<14} {:>14} {:>16} {:>10}'.format(
+        'workload', 'writer', 'writes/resp', 'bytes/resp', 'us/resp'))
+    for workload_name, make_response in workloads:
+        for writer_name, write in writers:
+            writes, size, usecs = await measure(make_response, write)
+            print('{:<12} {:<14} {:>14.1f} {:>16.0f} {:>10.1f}'.format(
+                workload_name, writer_name, writes, size, usecs))
+
+
+asyncio.run(main())
@@ -0,0 +1,227 @@
+"""
+chapter03/pico/benchmarks/server_load_benchmark.py
+
+Load test the routes of microdot_api_server_pico.py with CPython, to measure
+the performance of the Microdot server core on any computer.
+
+The server script is run unchanged in a child process, with the Pico W
+hardware modules (machine, picowifi and wifi_credentials) replaced by stubs,
+and Microdot.run() replaced so that the server listens on 127.0.0.1. The
+load generator is an asyncio client that sends requests over persistent
+connections from a number of concurrent clients, and reports for each
+workload:
+
+* requests per second
+* p50 and p99 latency
+* errors (responses other than 200)
+
+The memory used by each idle persistent connection in the server process is
+measured with tracemalloc.
+
+Note that the server script limits the number of requests handled at once
+with app.max_concurrent_requests, so requests above it are queued or
+rejected. Idle persistent connections do not count against the limit.
+
+Run with CPython from the chapter03/pico folder:
+
+$ python3 benchmarks/server_load_benchmark.py
+"""
+import asyncio
+import gc
+import json
+import multiprocessing
+import os
+import runpy
+import sys
+import time
+import tracemalloc
+import types
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+HOST = '127.0.0.1'
+PORT = 5099
+REQUESTS = 2000
+CLIENTS = [1, 8]
+IDLE_CONNECTIONS = 4
+
+
+def workloads():
+    post_body = json.dumps({'level': 42}).encode()
+    return [
+        ('HTML page', b'GET / HTTP/1.1\r\nHost: pico\r\n\r\n'),
+        ('static js', b'GET /static/jquery.min.js HTTP/1.1\r\n'
+                      b'Host: pico\r\n\r\n'),
+        ('JSON GET', b'GET /led HTTP/1.1\r\nHost: pico\r\n\r\n'),
+        ('JSON POST', b'POST /led HTTP/1.1\r\nHost: pico\r\n'
+                      b'Content-Type: application/json\r\n'
+                      b'Content-Length: ' + str(len(post_body)).encode() +
+                      b'\r\n\r\n' + post_body),
+    ]
+
+
+# Server process
+
+def stub_hardware():
+    """ Replace the Pico W modules used by the server script. """
+
+    class Pin:
+        OUT = 1
+
+        def __init__(self, *args, **kwargs):
+            pass
+
+    class PWM:
+        def __init__(self, pin):
+            pass
+
+        def freq(self, value):
+            pass
+
+        def duty_u16(self, value):
+            pass
+
+    machine = types.ModuleType('machine')
+    machine.Pin = Pin
+    machine.PWM = PWM
+    picowifi = types.ModuleType('picowifi')
+    picowifi.connect_wifi = lambda ssid, password: HOST
+    credentials = types.ModuleType('wifi_credentials')
+    credentials.SSID = credentials.PASSWORD = ''
+    sys.modules.update({'machine': machine, 'picowifi': picowifi,
+                        'wifi_credentials': credentials})
+
+
+def run_server(ready):
+    from microdot import Microdot
+
+    stub_hardware()
+    apps = []
+    Microdot.run = lambda self, *args, **kwargs: apps.append(self)
+    runpy.run_path('microdot_api_server_pico.py')
+    app = apps[0]
+
+    # Extra routes used by the benchmark to measure memory.
+    @app.post('/_benchmark/memory')
+    async def start_tracing(request):
+        tracemalloc.start()
+        return {}
+
+    @app.get('/_benchmark/memory')
+    async def traced_memory(request):
+        gc.collect()
+        return {'traced': tracemalloc.get_traced_memory()[0]}
+
+    async def main():
+        server = asyncio.create_task(app.start_server(host=HOST, port=PORT))
+        await asyncio.sleep(0.2)
+        ready.set()
+        await server
+
+    asyncio.run(main())
+
+
+# Load generator
+
+async def read_response(reader):
+    """ Read a response. Returns (status code, keep alive). """
+
+    head = await reader.readuntil(b'\r\n\r\n')
+    lines = head.decode().split('\r\n')
+    status_code = int(lines[0].split()[1])
+    headers = {}
+    for line in lines[1:]:
+        if ':' in line:
+            name, value = line.split(':', 1)
+            headers[name.strip().lower()] = value.strip().lower()
+    if 'content-length' in headers:
+        await reader.readexactly(int(headers['content-length']))
+    elif headers.get('transfer-encoding') == 'chunked':
+        while True:
+            size = int((await reader.readline()).strip(), 16)
+            await reader.readexactly(size + 2)
+            if size == 0:
+                break
+    return status_code, headers.get('connection') != 'close'
+
+
+async def client(request, count, latencies, errors):
+    reader = writer = None
+    for _ in range(count):
+        if writer is None:
+            reader, writer = await asyncio.open_connection(HOST, PORT)
+        start = time.perf_counter()
+        writer.write(request)
+        status_code, keep_alive = await read_response(reader)
+        latencies.append(time.perf_counter() - start)
+        if status_code != 200:
+            errors.append(status_code)
+        if not keep_alive:
+            writer.close()
+            writer = None
+    if writer is not None:
+        writer.close()
+
+
+async def load(request, clients):
+    latencies = []
+    errors = []
+    start = time.perf_counter()
+    await asyncio.gather(*[client(request, REQUESTS // clients, latencies,
+                                  errors) for _ in range(clients)])
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    return (len(latencies) / elapsed,
+            latencies[len(latencies) // 2] * 1000,
+            latencies[int(len(latencies) * 0.99)] * 1000,
+            len(errors))
+
+
+async def request_json(method, path):
+    reader, writer = await asyncio.open_connection(HOST, PORT)
+    writer.write('{} {} HTTP/1.1\r\nConnection: close\r\n'
+                 'Content-Length: 0\r\n\r\n'.format(method, path).encode())
+    data = await reader.read()
+    writer.close()
+    return json.loads(data.split(b'\r\n\r\n', 1)[1])
+
+
+async def memory_per_connection():
+    await request_json('POST', '/_benchmark/memory')
+    before = (await request_json('GET', '/_benchmark/memory'))['traced']
+    connections = []
+    for _ in range(IDLE_CONNECTIONS):
+        reader, writer = await asyncio.open_connection(HOST, PORT)
+        writer.write(b'GET /led HTTP/1.1\r\nHost: pico\r\n\r\n')
+        await read_response(reader)
+        connections.append(writer)
+    after = (await request_json('GET', '/_benchmark/memory'))['traced']
+    for writer in connections:
+        writer.close()
+    return (after - before) / IDLE_CONNECTIONS
+
+
+async def main():
+    print('{:<12} {:>7} {:>10} {:>10} {:>10} {:>7}'.format(
+        'workload', 'clients', 'req/s', 'p50 ms', 'p99 ms', 'errors'))
+    for name, request in workloads():
+        for clients in CLIENTS:
+            rate, p50, p99, errors = await load(request, clients)
+            print('{:<12} {:>7} {:>10.0f} {:>10.2f} {:>10.2f} {:>7}'.format(
+                name, clients, rate, p50, p99, errors))
+    print('memory per idle connection: {:.0f} bytes'.format(
+        await memory_per_connection()))
+
+
+if __name__ == '__main__':
+    os.chdir(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+    ready = multiprocessing.Event()
+    server = multiprocessing.Process(target=run_server, args=(ready,),
+                                     daemon=True)
+    server.start()
+    try:
+        if not ready.wait(10):
+            raise RuntimeError('The server did not start')
+        asyncio.run(main())
+    finally:
+        server.terminate()
@@ -0,0 +1,169 @@
+import binascii
+import hashlib
+import json
+import os
+from microdot.microdot import Response
+
+
+def make_etag(data):
+    """Return a strong ``ETag`` header value for the given bytes."""
+    return '"' + binascii.hexlify(hashlib.sha1(data).digest()[:8]).decode() \
+        + '"'
+
+
+class StaticCache:
+    """An in-memory cache for files served with
+    :meth:`send_file() <microdot.Response.send_file>`.
+
+    :param max_size: The maximum number of bytes of file data held in the
+                     cache. When adding a file would exceed this budget, the
+                     least recently used files are evicted.
+    :param max_file_size: Files that are larger than this are not cached and
+                          are streamed from storage as usual. If omitted,
+                          ``max_size`` is used.
+
+    Cached files are served with a strong ``ETag`` header, so that clients
+    that send a matching ``If-None-Match`` header receive a ``304`` response
+    without a body. The cache assumes that files do not change while the
+    application runs. Call :meth:`clear` after updating a file. Files that
+    are too large to be cached get an ``ETag`` from their size and
+    modification time instead.
+
+    Example::
+
+        from microdot import Response
+        from microdot.cache import StaticCache
+
+        Response.static_cache = StaticCache(max_size=32 * 1024)
+    """
+    def __init__(self, max_size=16 * 1024, max_file_size=None):
+        self.max_size = max_size
+        self.max_file_size = max_file_size or max_size
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.entries = {}  # filename: [data, etag, last used tick]
+        self.tick = 0
+
+    def lookup(self, filename):
+        """Return a ``(data, etag)`` tuple for the given file if it is in
+        the cache, or else ``None``. The file is not accessed."""
+        self.tick += 1
+        entry = self.entries.get(filename)
+        if entry is None:
+            return None
+        self.hits += 1
+        entry[2] = self.tick
+        return entry[0], entry[1]
+
+    def get(self, filename, size=None):
+        """Return a ``(data, etag)`` tuple for the given file, loading it
+        into the cache if necessary. ``None`` is returned for files that are
+        too large to be cached.
+
+        :param filename: The filename of the file.
+        :param size: The size of the file, when it is already known.
+        """
+        cached = self.lookup(filename)
+        if cached is not None:
+            return cached
+        self.misses += 1
+        if size is None:
+            size = os.stat(filename)[6]
+        if size > self.max_file_size:
+            return None
+        with open(filename, 'rb') as f:
+            data = f.read()
+        while self.entries and self.size + len(data) > self.max_size:
+            self.evict()
+        if self.size + len(data) > self.max_size:  # pragma: no cover
+            return None
+        entry = [data, make_etag(data), self.tick]
+        self.entries[filename] = entry
+        self.size += len(data)
+        return entry[0], entry[1]
+
+    def evict(self):
+        """Remove the least recently used file from the cache."""
+        oldest = None
+        for filename, entry in self.entries.items():
+            if oldest is None or entry[2] < self.entries[oldest][2]:
+                oldest = filename
+        self.size -= len(self.entries.pop(oldest)[0])
+
+    def clear(self):
+        """Remove all the files from the cache."""
+        self.entries = {}
+        self.size = 0
+
+
+class JSONCache:
+    """A cached JSON response for a value that changes rarely, such as the
+    state of a device.
+
+    :param value: The value to serialize, usually a ``dict``. The cache keeps
+                  a reference to it, so the value can be updated in place.
+
+    The value is serialized to JSON, and an ``ETag`` is calculated for it,
+    only the first time a response is requested after the value's version
+    changed. Call :meth:`bump` after every change to the value. Clients that
+    send a matching ``If-None-Match`` header receive a ``304`` response
+    without a body.
+
+    Example::
+
+        from microdot.cache import JSONCache
+
+        state = {'level': 50}
+        state_cache = JSONCache(state)
+
+        @app.get('/state')
+        async def get_state(request):
+            return state_cache.response()
+
+        @app.post('/state')
+        async def set_state(request):
+            state['level'] = request.json['level']
+            state_cache.bump()
+            return state_cache.response()
+    """
+    def __init__(self, value):
+        self.value = value
+        self.version = 0
+        self.hits = 0
+        self.misses = 0
+        self.body = None
+        self.etag = None
+        self.encoded_version = None
+
+    def bump(self):
+        """Mark the value as changed. The next response is serialized
+        again."""
+        self.version += 1
+
+    def encode(self):
+        """Return a ``(body, etag)`` tuple with the JSON encoded value, which
+        is serialized only if its version changed since the last call."""
+        if self.encoded_version == self.version:
+            self.hits += 1
+        else:
+            self.misses += 1
+            self.body = json.dumps(self.value).encode()
+            self.etag = make_etag(self.body)
+            self.encoded_version = self.version
+        return self.body, self.etag
+
+    def response(self, status_code=200, headers=None):
+        """Return a :class:`Response <microdot.Response>` with the JSON
+        encoded value.
+
+        :param status_code: The response's status code.
+        :param headers: Additional response headers.
+        """
+        body, etag = self.encode()
+        response_headers = {'Content-Type': 'application/json; charset=UTF-8',
+                            'Cache-Control': 'no-cache', 'ETag': etag}
+        if headers:
+            response_headers.update(headers)
+        return Response(body=body, status_code=status_code,
+                        headers=response_headers)
@@ -6,8 +6,10 @@ The ``microdot`` module defines a few classes that help implement HTTP-based
 servers for MicroPython and standard Python.
 """
 import asyncio
+import gc
 import io
 import json
+import os
 import time
 
 try:
@@ -40,6 +42,15 @@ except ImportError:  # pragma: no cover
             ret = await ret
         return ret
 
+try:
+    from time import ticks_ms, ticks_diff
+except ImportError:  # pragma: no cover
+    def ticks_ms():
+        return int(time.perf_counter() * 1000)
+
+    def ticks_diff(end, start):
+        return end - start
+
 try:
     from sys import print_exception
 except ImportError:  # pragma: no cover
@@ -145,6 +156,10 @@ class NoCaseDict(dict):
         for key, value in other_dict.items():
             self[key] = value
 
+    def clear(self):
+        super().clear()
+        self.keymap.clear()
+
 
 def mro(cls):  # pragma: no cover
     """Return the method resolution order of a class.
@@ -325,11 +340,52 @@ class Request:
     #:    Request.max_readline = 16 * 1024  # 16KB lines allowed
     max_readline = 2 * 1024
 
+    #: Specify the number of seconds allowed to receive the request line and
+    #: headers of a request. Clients that are slower receive a ``408``
+    #: response and the connection is closed. Set to ``None`` to wait
+    #: forever.
+    #:
+    #: Example::
+    #:
+    #:    Request.header_timeout = 5  # 5 seconds to send the headers
+    header_timeout = 10
+
+    #: Specify the number of seconds allowed to receive a request body that
+    #: is read into ``body``. Clients that are slower receive a ``408``
+    #: response and the connection is closed. Set to ``None`` to wait
+    #: forever.
+    #:
+    #: Example::
+    #:
+    #:    Request.body_timeout = 30  # 30 seconds to send the body
+    body_timeout = 10
+
+    #: Specify how many request objects are kept for reuse after their
+    #: requests are handled, to reduce the work of the garbage collector.
+    #: Request objects must not be used after the response is sent when this
+    #: is enabled. Set to 0 (the default) to disable reuse.
+    #:
+    #: Example::
+    #:
+    #:    Request.pool_size = 4
+    pool_size = 0
+
+    _pool = []
+
     class G:
         pass
 
     def __init__(self, app, client_addr, method, url, http_version, headers,
-                 body=None, stream=None, sock=None):
+                 body=None, stream=None, sock=None, raw_headers=None):
+        self.after_request_handlers = []
+        self.reset(app, client_addr, method, url, http_version, headers,
+                   body=body, stream=stream, sock=sock,
+                   raw_headers=raw_headers)
+
+    def reset(self, app, client_addr, method, url, http_version, headers,
+              body=None, stream=None, sock=None, raw_headers=None):
+        """Initialize the request object for a new request. The arguments
+        are the same as those of the class constructor."""
         #: The application instance to which this request belongs.
         self.app = app
         #: The address of the client, as a tuple (host, port).
@@ -342,34 +398,33 @@ class Request:
         self.path = url
         #: The query string portion of the URL.
         self.query_string = None
-        #: The parsed query string, as a
-        #: :class:`MultiDict <microdot.MultiDict>` object.
-        self.args = {}
-        #: A dictionary with the headers included in the request.
-        self.headers = headers
-        #: A dictionary with the cookies included in the request.
-        self.cookies = {}
         #: The parsed ``Content-Length`` header.
         self.content_length = 0
         #: The parsed ``Content-Type`` header.
         self.content_type = None
-        #: A general purpose container for applications to store data during
-        #: the life of the request.
-        self.g = Request.G()
+        self._g = None
+        #: The URL pattern of the route that matched the request, or ``None``
+        #: if no route matched.
+        self.url_rule = None
+        #: ``True`` when the request became a long-lived stream with
+        #: :meth:`Microdot.start_stream`.
+        self.streaming = False
 
         self.http_version = http_version
         if '?' in self.path:
             self.path, self.query_string = self.path.split('?', 1)
-            self.args = self._parse_urlencoded(self.query_string)
 
-        if 'Content-Length' in self.headers:
-            self.content_length = int(self.headers['Content-Length'])
-        if 'Content-Type' in self.headers:
-            self.content_type = self.headers['Content-Type']
-        if 'Cookie' in self.headers:
-            for cookie in self.headers['Cookie'].split(';'):
-                name, value = cookie.strip().split('=', 1)
-                self.cookies[name] = value
+        # headers, query string arguments and cookies are parsed on first
+        # access, as most requests do not need them
+        self._headers = headers
+        self._raw_headers = raw_headers or []
+        self._args = None
+        self._cookies = None
+
+        content_length = self.get_header('Content-Length')
+        if content_length:
+            self.content_length = int(content_length)
+        self.content_type = self.get_header('Content-Type')
 
         self._body = body
         self.body_used = False
@@ -377,10 +432,28 @@ class Request:
         self.sock = sock
         self._json = None
         self._form = None
-        self.after_request_handlers = []
+        self.after_request_handlers.clear()
+        self.url_args = None
+        self._pooled = False
+
+    def release(self):
+        """Return the request object to the pool of reusable objects, if
+        ``pool_size`` allows it. Microdot calls this method after the
+        response to the request is sent."""
+        if not self._pooled or len(Request._pool) >= Request.pool_size:
+            return
+        self._pooled = False
+        # drop references to request data so that it can be freed
+        self.app = self._body = self._stream = self.sock = None
+        self._headers = self._raw_headers = self._args = None
+        self._cookies = self._json = self._form = self._g = None
+        self.url_args = None
+        self.after_request_handlers.clear()
+        Request._pool.append(self)
 
     @staticmethod
-    async def create(app, client_reader, client_writer, client_addr):
+    async def create(app, client_reader, client_writer, client_addr,
+                     request_line=None, header_timeout=None):
         """Create a request object.
 
         :param app: The Microdot application instance.
@@ -389,43 +462,164 @@ class Request:
         :param client_writer: An output stream where the response data can be
                               written.
         :param client_addr: The address of the client, as a tuple.
+        :param request_line: The request line, if it was already read from
+                             ``client_reader``.
+        :param header_timeout: The number of seconds left to receive the
+                               request head, when part of it was already read.
+                               The default is ``header_timeout``.
 
         This method is a coroutine. It returns a newly created ``Request``
-        object.
+        object. An ``HTTPException`` with status code 408 is raised if the
+        request is not received within ``header_timeout`` and
+        ``body_timeout`` seconds.
         """
-        # request line
-        line = (await Request._safe_readline(client_reader)).strip().decode()
-        if not line:  # pragma: no cover
+        if header_timeout is None:
+            header_timeout = Request.header_timeout
+        try:
+            head = await Request._with_timeout(
+                Request._read_head(client_reader, request_line),
+                header_timeout)
+        except asyncio.TimeoutError:
+            app.header_timeouts += 1
+            raise HTTPException(408, 'Request timeout')
+        if head is None:  # pragma: no cover
             return None
+        line, raw_headers, content_length = head
         method, url, http_version = line.split()
         http_version = http_version.split('/', 1)[1]
 
-        # headers
-        headers = NoCaseDict()
-        content_length = 0
-        while True:
-            line = (await Request._safe_readline(
-                client_reader)).strip().decode()
-            if line == '':
-                break
-            header, value = line.split(':', 1)
-            value = value.strip()
-            headers[header] = value
-            if header.lower() == 'content-length':
-                content_length = int(value)
-
         # body
         body = b''
         if content_length and content_length <= Request.max_body_length:
-            body = await client_reader.readexactly(content_length)
+            try:
+                body = await Request._with_timeout(
+                    client_reader.readexactly(content_length),
+                    Request.body_timeout)
+            except asyncio.TimeoutError:
+                app.body_timeouts += 1
+                raise HTTPException(408, 'Request timeout')
             stream = None
         else:
             body = b''
             stream = client_reader
 
-        return Request(app, client_addr, method, url, http_version, headers,
-                       body=body, stream=stream,
-                       sock=(client_reader, client_writer))
+        if Request._pool:
+            req = Request._pool.pop()
+            req.reset(app, client_addr, method, url, http_version, None,
+                      body=body, stream=stream,
+                      sock=(client_reader, client_writer),
+                      raw_headers=raw_headers)
+        else:
+            req = Request(app, client_addr, method, url, http_version, None,
+                          body=body, stream=stream,
+                          sock=(client_reader, client_writer),
+                          raw_headers=raw_headers)
+        req._pooled = True
+        return req
+
+    @property
+    def g(self):
+        """A general purpose container for applications to store data
+        during the life of the request."""
+        if self._g is None:
+            self._g = Request.G()
+        return self._g
+
+    @g.setter
+    def g(self, value):
+        self._g = value
+
+    @property
+    def headers(self):
+        """A dictionary with the headers included in the request."""
+        if self._headers is None:
+            headers = NoCaseDict()
+            for line in self._raw_headers:
+                header, value = line.decode().split(':', 1)
+                headers[header] = value.strip()
+            self._headers = headers
+        return self._headers
+
+    @headers.setter
+    def headers(self, value):
+        self._headers = value
+
+    def get_header(self, name, default=None):
+        """Return the value of a single request header.
+
+        :param name: The name of the header, in any case.
+        :param default: The value to return if the header is not present.
+
+        Unlike accessing the :attr:`headers` dictionary, this method does not
+        need to decode all the headers of the request.
+        """
+        if self._headers is not None:
+            return self._headers.get(name, default)
+        name = name.lower().encode()
+        n = len(name)
+        for line in self._raw_headers:
+            if len(line) > n and line[n] == 58 and \
+                    line[:n].lower() == name:  # 58 is ':'
+                return line[n + 1:].strip().decode()
+        return default
+
+    def accepts_encoding(self, coding):
+        """Check if the client accepts a content coding, such as ``gzip``,
+        in its ``Accept-Encoding`` header.
+
+        :param coding: The name of the content coding, in lowercase.
+
+        Codings listed with a quality value of 0, as in ``gzip;q=0``, are
+        not accepted. The ``*`` wildcard accepts codings that are not
+        listed.
+        """
+        wildcard = False
+        for item in self.get_header('Accept-Encoding', '').split(','):
+            params = item.split(';')
+            name = params[0].strip().lower()
+            if name != coding and name != '*':
+                continue
+            quality = 1
+            for param in params[1:]:
+                param = param.strip()
+                if param[:2].lower() == 'q=':
+                    try:
+                        quality = float(param[2:])
+                    except ValueError:
+                        quality = 0
+            if name == coding:
+                return quality > 0
+            wildcard = quality > 0
+        return wildcard
+
+    @property
+    def args(self):
+        """The parsed query string, as a
+        :class:`MultiDict <microdot.MultiDict>` object."""
+        if self._args is None:
+            self._args = self._parse_urlencoded(self.query_string) \
+                if self.query_string else MultiDict()
+        return self._args
+
+    @args.setter
+    def args(self, value):
+        self._args = value
+
+    @property
+    def cookies(self):
+        """A dictionary with the cookies included in the request."""
+        if self._cookies is None:
+            self._cookies = {}
+            cookie_header = self.get_header('Cookie')
+            if cookie_header:
+                for cookie in cookie_header.split(';'):
+                    name, value = cookie.strip().split('=', 1)
+                    self._cookies[name] = value
+        return self._cookies
+
+    @cookies.setter
+    def cookies(self, value):
+        self._cookies = value
 
     def _parse_urlencoded(self, urlencoded):
         data = MultiDict()
@@ -506,6 +700,36 @@ class Request:
         self.after_request_handlers.append(f)
         return f
 
+    @staticmethod
+    async def _read_head(stream, request_line=None):
+        # request line
+        line = (request_line or await Request._safe_readline(stream)) \
+            .strip().decode()
+        if not line:  # pragma: no cover
+            return None
+
+        # headers are stored as the raw lines that were received, and only
+        # the Content-Length header is decoded here
+        raw_headers = []
+        content_length = 0
+        while True:
+            header = await Request._safe_readline(stream)
+            if header in (b'\r\n', b'\n', b''):
+                break
+            if b':' not in header:
+                raise ValueError('invalid header')
+            raw_headers.append(header)
+            if len(header) > 15 and header[14] == 58 and \
+                    header[:14].lower() == b'content-length':  # 58 is ':'
+                content_length = int(header[15:])
+        return line, raw_headers, content_length
+
+    @staticmethod
+    async def _with_timeout(coro, timeout):
+        if timeout is None:
+            return await coro
+        return await asyncio.wait_for(coro, timeout)
+
     @staticmethod
     async def _safe_readline(stream):
         line = (await stream.readline())
@@ -540,8 +764,20 @@ class Response:
         'txt': 'text/plain',
     }
 
+    #: The size of the buffer used to stream file bodies to the client.
+    #: File-like objects that implement ``readinto()`` are read into a
+    #: single buffer of this size that is reused for the whole response.
+    #:
+    #: Example::
+    #:
+    #:    Response.send_file_buffer_size = 512  # smaller writes, less RAM
     send_file_buffer_size = 1024
 
+    #: Bodies of this size or smaller are sent in the same write as the
+    #: status line and headers. Larger bodies are written separately, to
+    #: avoid copying them into the header buffer.
+    inline_body_size = 1024
+
     #: The content type to use for responses that do not explicitly define a
     #: ``Content-Type`` header.
     default_content_type = 'text/plain'
@@ -550,16 +786,71 @@ class Response:
     #: of ``None`` means that no ``Cache-Control`` header is added.
     default_send_file_max_age = None
 
+    #: An optional cache used by :meth:`send_file` to serve static files
+    #: from memory. A value of ``None`` (the default) means that files are
+    #: read from storage on every request.
+    #:
+    #: Example::
+    #:
+    #:    from microdot.cache import StaticCache
+    #:
+    #:    Response.static_cache = StaticCache(max_size=32 * 1024)
+    static_cache = None
+
     #: Special response used to signal that a response does not need to be
     #: written to the client. Used to exit WebSocket connections cleanly.
     already_handled = None
 
+    #: Specify how many response objects are kept for reuse after they are
+    #: sent, to reduce the work of the garbage collector. Only the responses
+    #: that Microdot creates from the return values of routes are reused.
+    #: Set to 0 (the default) to disable reuse.
+    #:
+    #: Example::
+    #:
+    #:    Response.pool_size = 4
+    pool_size = 0
+
+    _pool = []
+
     def __init__(self, body='', status_code=200, headers=None, reason=None):
+        self.headers = NoCaseDict()
+        self.reset(body, status_code, headers, reason)
+
+    @staticmethod
+    def acquire(body='', status_code=200, headers=None, reason=None):
+        """Return a response object, reusing one from the pool if
+        possible. The arguments are the same as those of the class
+        constructor."""
+        if Response._pool:
+            res = Response._pool.pop()
+            res.reset(body, status_code, headers, reason)
+        else:
+            res = Response(body, status_code, headers, reason)
+        res._pooled = True
+        return res
+
+    def release(self):
+        """Return the response object to the pool of reusable objects, if it
+        was created by :meth:`acquire` and ``pool_size`` allows it. Microdot
+        calls this method after the response is sent."""
+        if not self._pooled or len(Response._pool) >= Response.pool_size:
+            return
+        self._pooled = False
+        self.body = None
+        self.headers.clear()
+        Response._pool.append(self)
+
+    def reset(self, body='', status_code=200, headers=None, reason=None):
+        """Initialize the response object with new contents. The arguments
+        are the same as those of the class constructor."""
         if body is None and status_code == 200:
             body = ''
             status_code = 204
         self.status_code = status_code
-        self.headers = NoCaseDict(headers or {})
+        self.headers.clear()
+        if headers:
+            self.headers.update(headers)
         self.reason = reason
         if isinstance(body, (dict, list)):
             self.body = json.dumps(body).encode()
@@ -570,6 +861,9 @@ class Response:
             # this applies to bytes, file-like objects or generators
             self.body = body
         self.is_head = False
+        #: The HTTP version used in the status line of the response.
+        self.http_version = '1.0'
+        self._pooled = False
 
     def set_cookie(self, cookie, value, path=None, domain=None, expires=None,
                    max_age=None, secure=False, http_only=False,
@@ -622,9 +916,17 @@ class Response:
                         max_age=0, **kwargs)
 
     def complete(self):
-        if isinstance(self.body, bytes) and \
+        if self.status_code == 304:
+            # a 304 has no body, and must not report a length that differs
+            # from the one of the full response
+            pass
+        elif isinstance(self.body, bytes) and \
                 'Content-Length' not in self.headers:
             self.headers['Content-Length'] = str(len(self.body))
+        elif self.http_version == '1.1' and self.is_generator() and \
+                'Content-Length' not in self.headers:
+            # the length of the body is not known in advance
+            self.headers['Transfer-Encoding'] = 'chunked'
         if 'Content-Type' not in self.headers:
             self.headers['Content-Type'] = self.default_content_type
             if 'charset=' not in self.headers['Content-Type']:
@@ -634,36 +936,15 @@ class Response:
         self.complete()
 
         try:
-            # status code
-            reason = self.reason if self.reason is not None else \
-                ('OK' if self.status_code == 200 else 'N/A')
-            await stream.awrite('HTTP/1.0 {status_code} {reason}\r\n'.format(
-                status_code=self.status_code, reason=reason).encode())
-
-            # headers
-            for header, value in self.headers.items():
-                values = value if isinstance(value, list) else [value]
-                for value in values:
-                    await stream.awrite('{header}: {value}\r\n'.format(
-                        header=header, value=value).encode())
-            await stream.awrite(b'\r\n')
-
-            # body
-            if not self.is_head:
-                iter = self.body_iter()
-                async for body in iter:
-                    if isinstance(body, str):  # pragma: no cover
-                        body = body.encode()
-                    try:
-                        await stream.awrite(body)
-                    except OSError as exc:  # pragma: no cover
-                        if exc.errno in MUTED_SOCKET_ERRORS or \
-                                exc.args[0] == 'Connection lost':
-                            if hasattr(iter, 'aclose'):
-                                await iter.aclose()
-                        raise
-                if hasattr(iter, 'aclose'):  # pragma: no branch
-                    await iter.aclose()
+            # status line, headers and small bodies are sent in one write
+            head = self.encode_head()
+            if not self.is_head and isinstance(self.body, bytes) and \
+                    len(self.body) <= self.inline_body_size:
+                await stream.awrite(head + self.body if self.body else head)
+            else:
+                await stream.awrite(head)
+                if not self.is_head:
+                    await self.write_body(stream)
 
         except OSError as exc:  # pragma: no cover
             if exc.errno in MUTED_SOCKET_ERRORS or \
@@ -672,6 +953,87 @@ class Response:
             else:
                 raise
 
+    def is_generator(self):
+        """Return ``True`` if the body of the response is a generator or an
+        async generator."""
+        return hasattr(self.body, '__anext__') or (
+            hasattr(self.body, '__next__') and not hasattr(self.body, 'read'))
+
+    def make_conditional(self, request):
+        """Turn the response into a ``304 Not Modified`` response if its
+        ``ETag`` header matches the ``If-None-Match`` header of the request.
+
+        :param request: The request object.
+
+        Microdot calls this method on every successful response to a ``GET``
+        or ``HEAD`` request, so routes only need to set the ``ETag`` header.
+        """
+        if self.status_code != 200 or 'ETag' not in self.headers:
+            return
+        if_none_match = request.get_header('If-None-Match')
+        if not if_none_match:
+            return
+        etag = self.headers['ETag']
+        if etag.startswith('W/'):
+            etag = etag[2:]
+        for candidate in if_none_match.split(','):
+            candidate = candidate.strip()
+            if candidate.startswith('W/'):
+                candidate = candidate[2:]
+            if candidate == etag or candidate == '*':
+                break
+        else:
+            return
+        if hasattr(self.body, 'close'):
+            self.body.close()
+        self.status_code = 304
+        self.reason = 'Not Modified'
+        self.body = b''
+        self.headers.pop('Content-Length', None)
+        self.headers.pop('Transfer-Encoding', None)
+
+    def encode_head(self):
+        """Return the status line and headers of the response, encoded as a
+        single bytes object that ends with the blank line that separates the
+        headers from the body."""
+        reason = self.reason if self.reason is not None else \
+            ('OK' if self.status_code == 200 else 'N/A')
+        lines = ['HTTP/{http_version} {status_code} {reason}'.format(
+            http_version=self.http_version, status_code=self.status_code,
+            reason=reason)]
+        for header, value in self.headers.items():
+            values = value if isinstance(value, list) else [value]
+            for value in values:
+                lines.append('{header}: {value}'.format(header=header,
+                                                        value=value))
+        lines.append('\r\n')
+        return '\r\n'.join(lines).encode()
+
+    async def write_body(self, stream):
+        chunked = self.headers.get('Transfer-Encoding') == 'chunked'
+        iter = self.body_iter()
+        async for body in iter:
+            if isinstance(body, str):  # pragma: no cover
+                body = body.encode()
+            if chunked:
+                if not body:
+                    # an empty chunk would terminate the body
+                    continue
+                body = '{:x}\r\n'.format(len(body)).encode() + body + \
+                    b'\r\n'
+            try:
+                await stream.awrite(body)
+            except OSError as exc:  # pragma: no cover
+                if exc.errno in MUTED_SOCKET_ERRORS or \
+                        exc.args[0] == 'Connection lost':
+                    if hasattr(iter, 'aclose'):
+                        await iter.aclose()
+                raise
+        if hasattr(iter, 'aclose'):  # pragma: no branch
+            await iter.aclose()
+        if chunked:
+            await stream.awrite(b'0\r\n\r\n')
+
     def body_iter(self):
         if hasattr(self.body, '__anext__'):
             # response body is an async generator
@@ -690,6 +1052,7 @@ class Response:
                     self.i = self.ITER_UNKNOWN  # need to determine type
                 else:
                     self.i = self.ITER_NO_BODY
+                self.buf = None
                 return self
 
             async def __anext__(self):
@@ -711,6 +1074,20 @@ class Response:
                     except StopIteration:
                         await self.aclose()
                         raise StopAsyncIteration
+                if hasattr(response.body, 'readinto'):
+                    # read all chunks into the same buffer
+                    if self.buf is None:
+                        self.buf = memoryview(
+                            bytearray(response.send_file_buffer_size))
+                    n = response.body.readinto(self.buf)
+                    if iscoroutine(n):  # pragma: no cover
+                        n = await n
+                    if not n:
+                        n = 0
+                    if n < len(self.buf):
+                        self.i = self.ITER_NO_BODY
+                        return self.buf[:n]
+                    return self.buf
                 buf = response.body.read(response.send_file_buffer_size)
                 if iscoroutine(buf):  # pragma: no cover
                     buf = await buf
@@ -741,7 +1118,7 @@ class Response:
     @classmethod
     def send_file(cls, filename, status_code=200, content_type=None,
                   stream=None, max_age=None, compressed=False,
-                  file_extension=''):
+                  file_extension='', request=None):
         """Send file contents in a response.
 
         :param filename: The filename of the file.
@@ -763,11 +1140,22 @@ class Response:
                            string with the header value can also be passed.
                            Note that when using this option the file must have
                            been compressed beforehand. This option only sets
-                           the header.
+                           the header. Pass ``'auto'`` to serve a gzip
+                           compressed copy of the file stored with a ``.gz``
+                           extension when it exists and the client accepts
+                           it, or else the uncompressed file.
         :param file_extension: A file extension to append to the ``filename``
                                parameter when opening the file, including the
                                dot. The extension given here is not considered
                                when generating the ``Content-Type`` header.
+        :param request: The request object. Required when ``compressed`` is
+                        ``'auto'``, to check the ``Accept-Encoding`` header.
+                        When given, a single byte range requested in the
+                        ``Range`` header is honored with a
+                        ``206 Partial Content`` response, and a
+                        ``304 Not Modified`` response is returned without
+                        opening the file when the ``If-None-Match`` header
+                        matches the file's ``ETag``.
 
         Security note: The filename is assumed to be trusted. Never pass
         filenames provided by the user without validating and sanitizing them
@@ -786,12 +1174,152 @@ class Response:
         if max_age is not None:
             headers['Cache-Control'] = 'max-age={}'.format(max_age)
 
+        if compressed == 'auto':
+            headers['Vary'] = 'Accept-Encoding'
+            compressed = False
+            if stream is None and request is not None and \
+                    request.accepts_encoding('gzip') and \
+                    cls._file_exists(filename + file_extension + '.gz'):
+                file_extension += '.gz'
+                compressed = 'gzip'
         if compressed:
             headers['Content-Encoding'] = compressed \
                 if isinstance(compressed, str) else 'gzip'
 
+        byte_range = None
+        if stream is None:
+            headers['Accept-Ranges'] = 'bytes'
+            if request is not None and status_code == 200:
+                byte_range = request.get_header('Range')
+
+        cached = None
+        size = None
+        if stream is None:
+            if cls.static_cache is not None:
+                cached = cls.static_cache.lookup(filename + file_extension)
+            if cached is None:
+                try:
+                    st = os.stat(filename + file_extension)
+                    size = st[6]
+                except OSError:
+                    pass
+                if size is not None and cls.static_cache is not None:
+                    cached = cls.static_cache.get(filename + file_extension,
+                                                  size)
+            if cached is not None:
+                headers['ETag'] = cached[1]
+                body = cached[0]
+                if byte_range:
+                    byte_range = cls._parse_range(byte_range, len(body))
+                    if byte_range:
+                        body = body[byte_range[0]:byte_range[1] + 1]
+                return cls._range_response(body, status_code, headers,
+                                           byte_range, len(cached[0]))
+        if size is not None:
+            headers['Content-Length'] = str(size)
+            # files that are not cached get a validator from their size and
+            # modification time, so that unchanged files are not sent again
+            headers['ETag'] = '"{:x}-{:x}"'.format(int(st[8]), size)
+            if request is not None and request.method in ('GET', 'HEAD') \
+                    and status_code == 200:
+                res = cls(body=b'', status_code=status_code, headers=headers)
+                res.make_conditional(request)
+                if res.status_code == 304:
+                    return res
+        if byte_range and size is not None:
+            byte_range = cls._parse_range(byte_range, size)
+        else:
+            byte_range = None
+        if byte_range is False:
+            return cls._range_response(b'', status_code, headers, False, size)
         f = stream or open(filename + file_extension, 'rb')
-        return cls(body=f, status_code=status_code, headers=headers)
+        if byte_range:
+            f.seek(byte_range[0])
+            f = _FileRange(f, byte_range[1] - byte_range[0] + 1)
+        return cls._range_response(f, status_code, headers, byte_range, size)
+
+    @staticmethod
+    def _parse_range(value, size):
+        # returns (first, last) for a satisfiable single range, False for an
+        # unsatisfiable range and None when the header should be ignored
+        if not value.startswith('bytes=') or ',' in value:
+            return None
+        try:
+            first, last = value[6:].strip().split('-', 1)
+            if first:
+                first = int(first)
+                if last:
+                    last = int(last)
+                    if last < first:
+                        # syntactically invalid, so the header is ignored
+                        return None
+                    last = min(last, size - 1)
+                else:
+                    last = size - 1
+            elif last:
+                # suffix range with the last N bytes
+                first = max(size - int(last), 0)
+                last = size - 1
+            else:
+                return None
+        except ValueError:
+            return None
+        if first >= size:
+            return False
+        return first, last
+
+    @classmethod
+    def _range_response(cls, body, status_code, headers, byte_range, size):
+        if byte_range is False:
+            headers['Content-Range'] = 'bytes */{}'.format(size)
+            headers.pop('Content-Length', None)
+            return cls(body=b'', status_code=416, headers=headers,
+                       reason='Range Not Satisfiable')
+        if byte_range:
+            first, last = byte_range
+            headers['Content-Range'] = 'bytes {}-{}/{}'.format(first, last,
+                                                              size)
+            headers['Content-Length'] = str(last - first + 1)
+            return cls(body=body, status_code=206, headers=headers,
+                       reason='Partial Content')
+        return cls(body=body, status_code=status_code, headers=headers)
+
+    @classmethod
+    def _file_exists(cls, filename):
+        if cls.static_cache is not None and \
+                filename in cls.static_cache.entries:
+            return True
+        try:
+            os.stat(filename)
+            return True
+        except OSError:
+            return False
+
+
+class _FileRange:
+    """A read-only view of a file that ends after ``length`` bytes."""
+    def __init__(self, f, length):
+        self.f = f
+        self.remaining = length
+
+    def readinto(self, buf):
+        if self.remaining <= 0:
+            return 0
+        if len(buf) > self.remaining:
+            buf = memoryview(buf)[:self.remaining]
+        n = self.f.readinto(buf) or 0
+        self.remaining -= n
+        return n
+
+    def read(self, n=-1):
+        if n < 0 or n > self.remaining:
+            n = self.remaining
+        data = self.f.read(n)
+        self.remaining -= len(data)
+        return data
+
+    def close(self):
+        self.f.close()
 
 
 class URLPattern():
@@ -799,6 +1327,11 @@ class URLPattern():
         self.url_pattern = url_pattern
         self.segments = []
         self.regex = None
+        #: The normalized path when the pattern has no dynamic components,
+        #: else ``None``.
+        self.static_path = None
+        #: The first path segment when it is static, else ``None``.
+        self.first_segment = None
         pattern = ''
         use_regex = False
         for segment in url_pattern.lstrip('/').split('/'):
@@ -831,6 +1364,13 @@ class URLPattern():
             else:
                 pattern += '/' + segment
                 self.segments.append({'parser': self._static_segment(segment)})
+        if 'name' not in self.segments[0]:
+            self.first_segment = url_pattern.lstrip('/').split('/', 1)[0]
+            for segment in self.segments:
+                if 'name' in segment:
+                    break
+            else:
+                self.static_path = '/' + url_pattern.lstrip('/')
         if use_regex:
             import re
             self.regex = re.compile('^' + pattern + '$')
@@ -911,9 +1451,70 @@ class Microdot:
 
         app = Microdot()
     """
+    #: Specify the number of seconds that an idle persistent connection is
+    #: kept open while waiting for the next request. Applications can change
+    #: this value as necessary.
+    #:
+    #: Example::
+    #:
+    #:    Microdot.keep_alive_timeout = 2  # close idle connections after 2s
+    keep_alive_timeout = 5
+
+    #: Specify the maximum number of requests that are served over a single
+    #: persistent connection before it is closed. Set to 1 to disable
+    #: persistent connections.
+    #:
+    #: Example::
+    #:
+    #:    Microdot.max_keep_alive_requests = 1  # one request per connection
+    max_keep_alive_requests = 100
+
+    #: Specify the maximum number of requests that are handled concurrently.
+    #: A request takes a slot when its request line arrives, and releases it
+    #: once its response is sent, so idle persistent connections do not count
+    #: against this limit. Requests that become long-lived streams, such as
+    #: WebSocket and Server-Sent Events connections, move to the
+    #: ``max_streaming_connections`` limit. Requests above this limit wait in
+    #: a queue for a free slot. A value of ``None`` (the default) means there
+    #: is no limit.
+    #:
+    #: Example::
+    #:
+    #:    Microdot.max_concurrent_requests = 4  # at most 4 requests
+    max_concurrent_requests = None
+
+    #: Specify how many requests can wait for a free slot when
+    #: ``max_concurrent_requests`` is reached. Requests that arrive when the
+    #: queue is full receive a ``503`` response immediately.
+    max_queued_requests = 4
+
+    #: Specify the number of seconds a queued request waits for a free slot
+    #: before it receives a ``503`` response.
+    queue_timeout = 2
+
+    #: Specify the maximum number of long-lived streams, such as WebSocket
+    #: and Server-Sent Events connections, that are open at the same time.
+    #: Requests that try to start a stream above this limit receive a ``503``
+    #: response. A value of ``None`` (the default) means there is no limit.
+    #:
+    #: Example::
+    #:
+    #:    Microdot.max_streaming_connections = 4
+    max_streaming_connections = None
+
+    #: The value of the ``Retry-After`` header, in seconds, sent with ``503``
+    #: responses when the server is busy.
+    retry_after = 1
+
+    #: An optional object that records request metrics. See
+    #: :class:`Metrics <microdot.metrics.Metrics>`, which sets this attribute
+    #: when it is attached to an application.
+    metrics = None
 
     def __init__(self):
         self.url_map = []
+        self.route_index = None
+        self.route_index_size = 0
         self.before_request_handlers = []
         self.after_request_handlers = []
         self.after_error_request_handlers = []
@@ -922,6 +1523,27 @@ class Microdot:
         self.options_handler = self.default_options_handler
         self.debug = False
         self.server = None
+        #: The number of requests currently being handled.
+        self.active_requests = 0
+        #: The highest number of requests handled at the same time.
+        self.peak_requests = 0
+        #: The number of requests rejected with a ``503`` response.
+        self.rejected_requests = 0
+        #: The number of long-lived streams currently open.
+        self.streaming_connections = 0
+        #: The lowest free heap seen when a request was admitted, or
+        #: ``None`` if the platform does not report it.
+        self.min_free_heap = None
+        self.request_queue = []
+        #: The number of connections closed because the request line and
+        #: headers were not received within ``Request.header_timeout``.
+        self.header_timeouts = 0
+        #: The number of connections closed because the request body was
+        #: not received within ``Request.body_timeout``.
+        self.body_timeouts = 0
+        #: The number of persistent connections closed after being idle for
+        #: ``keep_alive_timeout`` seconds.
+        self.idle_timeouts = 0
 
     def route(self, url_pattern, methods=None):
         """Decorator that is used to register a function as a request handler
@@ -1210,6 +1832,10 @@ class Microdot:
             if not hasattr(writer, 'awrite'):  # pragma: no cover
                 # CPython provides the awrite and aclose methods in 3.8+
                 async def awrite(self, data):
+                    if isinstance(data, memoryview):
+                        # the transport may hold on to the data after drain()
+                        # returns, and memoryviews point to reused buffers
+                        data = bytes(data)
                     self.write(data)
                     await self.drain()
 
@@ -1296,6 +1922,159 @@ class Microdot:
         """
         self.server.close()
 
+    def build_route_index(self):
+        """Compile the URL map into a dispatch index.
+
+        Routes without dynamic components are stored in a dictionary keyed by
+        their full path. Routes that start with a static segment are grouped
+        in buckets keyed by that segment, and the remaining routes are kept
+        in a list that is checked for every request. Each entry records its
+        position in the URL map, so that routes are still matched in the
+        order in which they were registered.
+
+        The index is rebuilt automatically when routes are added, so there is
+        normally no need to call this method directly.
+        """
+        static = {}
+        buckets = {}
+        wildcard = []
+        for i, (route_methods, route_pattern, route_handler) in \
+                enumerate(self.url_map):
+            entry = (i, route_methods, route_pattern, route_handler)
+            if route_pattern.static_path is not None:
+                static.setdefault(route_pattern.static_path, []).append(entry)
+            elif route_pattern.first_segment is not None:
+                buckets.setdefault(route_pattern.first_segment, []).append(
+                    entry)
+            else:
+                wildcard.append(entry)
+        self.route_index = (static, buckets, wildcard)
+        self.route_index_size = len(self.url_map)
+
+    def find_route_candidates(self, path):
+        """Return the routes that can match the given path, in registration
+        order. Each route is returned as a tuple with the URL map position,
+        methods, URL pattern and handler."""
+        if self.route_index is None or \
+                self.route_index_size != len(self.url_map):
+            self.build_route_index()
+        static, buckets, wildcard = self.route_index
+        if len(path) == 0 or path[0] != '/':
+            return []
+        groups = [group for group in (
+            static.get(path), buckets.get(path[1:].split('/', 1)[0]),
+            wildcard) if group]
+        if len(groups) == 1:
+            return groups[0]
+        candidates = []
+        for group in groups:
+            candidates.extend(group)
+        candidates.sort(key=lambda entry: entry[0])
+        return candidates
+
+    async def acquire_request_slot(self):
+        """Wait for a free request slot. Returns ``False`` if the request
+        must be rejected because the server is busy."""
+        if self.max_concurrent_requests is not None and \
+                self.active_requests >= self.max_concurrent_requests:
+            if len(self.request_queue) >= self.max_queued_requests:
+                return False
+            event = asyncio.Event()
+            self.request_queue.append(event)
+            try:
+                await asyncio.wait_for(event.wait(), self.queue_timeout)
+            except asyncio.TimeoutError:
+                if event in self.request_queue:
+                    self.request_queue.remove(event)
+                    return False
+                # the slot was handed over as the timeout expired
+        else:
+            self.active_requests += 1
+        if self.active_requests > self.peak_requests:
+            self.peak_requests = self.active_requests
+        if hasattr(gc, 'mem_free'):  # pragma: no cover
+            free = gc.mem_free()
+            if self.min_free_heap is None or free < self.min_free_heap:
+                self.min_free_heap = free
+        return True
+
+    def release_request_slot(self):
+        """Release a request slot, handing it over to the oldest queued
+        request if there is one."""
+        if self.request_queue:
+            self.request_queue.pop(0).set()
+        else:
+            self.active_requests -= 1
+
+    def start_stream(self, request):
+        """Move a request that becomes a long-lived stream, such as a
+        WebSocket or Server-Sent Events connection, from the
+        ``max_concurrent_requests`` limit to the ``max_streaming_connections``
+        limit, so that it does not hold a request slot while it is open.
+
+        :param request: The request object.
+
+        Returns ``False`` if the request must be rejected because too many
+        streams are open.
+        """
+        if request.streaming:
+            return True
+        if self.max_streaming_connections is not None and \
+                self.streaming_connections >= self.max_streaming_connections:
+            self.rejected_requests += 1
+            return False
+        self.streaming_connections += 1
+        request.streaming = True
+        self.release_request_slot()
+        return True
+
+    def release_slot(self, req):
+        """Release the request or stream slot held by a request."""
+        if req is not None and req.streaming:
+            self.streaming_connections -= 1
+        else:
+            self.release_request_slot()
+
+    def busy_response(self):
+        """Return the ``503`` response sent when the server is busy. This
+        response is also used for ``abort(503)`` when the application does not
+        have an error handler for the ``503`` status code."""
+        return Response('Service unavailable', 503,
+                        {'Retry-After': str(self.retry_after),
+                         'Connection': 'close'},
+                        reason='Service Unavailable')
+
+    async def reject_request(self, reader, writer):
+        """Send a ``503`` response to a request that could not be admitted,
+        without parsing the rest of its head."""
+        self.rejected_requests += 1
+        try:
+            # discard the request head in small reads, as closing a socket
+            # with unread data resets the connection before the client can
+            # see the response
+            await asyncio.wait_for(self._discard_request_head(reader), 0.2)
+        except (asyncio.TimeoutError, OSError):  # pragma: no cover
+            pass
+        await self.busy_response().write(writer)
+        try:
+            await writer.aclose()
+        except OSError as exc:  # pragma: no cover
+            if exc.errno not in MUTED_SOCKET_ERRORS:
+                raise
+        if self.debug:  # pragma: no cover
+            print('503 server busy, {} active'.format(self.active_requests))
+
+    @staticmethod
+    async def _discard_request_head(reader):
+        tail = b''
+        received = 0
+        while received < Request.max_readline:
+            data = await reader.read(128)
+            if not data or b'\r\n\r\n' in tail + data:
+                break
+            tail = data[-3:]
+            received += len(data)
+
     def find_route(self, req):
         method = req.method.upper()
         if method == 'OPTIONS' and self.options_handler:
@@ -1303,11 +2082,17 @@ class Microdot:
         if method == 'HEAD':
             method = 'GET'
         f = 404
-        for route_methods, route_pattern, route_handler in self.url_map:
-            req.url_args = route_pattern.match(req.path)
+        req.url_args = None
+        for _, route_methods, route_pattern, route_handler in \
+                self.find_route_candidates(req.path):
+            if route_pattern.static_path is not None:
+                req.url_args = {}
+            else:
+                req.url_args = route_pattern.match(req.path)
             if req.url_args is not None:
                 if method in route_methods:
                     f = route_handler
+                    req.url_rule = route_pattern.url_pattern
                     break
                 else:
                     f = 405
@@ -1315,8 +2100,10 @@ class Microdot:
 
     def default_options_handler(self, req):
         allow = []
-        for route_methods, route_pattern, route_handler in self.url_map:
-            if route_pattern.match(req.path) is not None:
+        for _, route_methods, route_pattern, route_handler in \
+                self.find_route_candidates(req.path):
+            if route_pattern.static_path is not None or \
+                    route_pattern.match(req.path) is not None:
                 allow.extend(route_methods)
         if 'GET' in allow:
             allow.append('HEAD')
@@ -1324,16 +2111,112 @@ class Microdot:
         return {'Allow': ', '.join(allow)}
 
     async def handle_request(self, reader, writer):
+        metrics = self.metrics
+        # responses are written through a byte counter when metrics are on
+        output = writer if metrics is None else metrics.stream(writer)
+        requests = 0
+        # a request slot is held from the arrival of the request line to the
+        # end of the response, so that idle connections do not take one
+        slot = False
         req = None
         try:
-            req = await Request.create(self, reader, writer,
-                                       writer.get_extra_info('peername'))
-        except Exception as exc:  # pragma: no cover
-            print_exception(exc)
-
-        res = await self.dispatch_request(req)
-        if res != Response.already_handled:  # pragma: no branch
-            await res.write(writer)
+            while True:
+                req = None
+                header_timeout = None
+                try:
+                    if requests:
+                        # wait for the next request on a persistent connection
+                        try:
+                            line = await asyncio.wait_for(
+                                Request._safe_readline(reader),
+                                self.keep_alive_timeout)
+                        except asyncio.TimeoutError:
+                            self.idle_timeouts += 1
+                            break
+                        if metrics:
+                            started = metrics.now()
+                    else:
+                        if metrics:
+                            started = metrics.now()
+                        line_started = ticks_ms()
+                        try:
+                            line = await Request._with_timeout(
+                                Request._safe_readline(reader),
+                                Request.header_timeout)
+                        except asyncio.TimeoutError:
+                            self.header_timeouts += 1
+                            raise HTTPException(408, 'Request timeout')
+                        if Request.header_timeout is not None:
+                            # the request line and the headers share a single
+                            # header_timeout
+                            header_timeout = max(
+                                0, Request.header_timeout - ticks_diff(
+                                    ticks_ms(), line_started) / 1000)
+                    if not line:
+                        break
+                    if not await self.acquire_request_slot():
+                        await self.reject_request(reader, writer)
+                        return
+                    slot = True
+                    req = await Request.create(
+                        self, reader, writer,
+                        writer.get_extra_info('peername'), request_line=line,
+                        header_timeout=header_timeout)
+                except HTTPException as exc:
+                    # the client was too slow sending the request
+                    res = Response(exc.reason, exc.status_code,
+                                   {'Connection': 'close'},
+                                   reason='Request Timeout')
+                    await res.write(output)
+                    if metrics:
+                        now = metrics.now()
+                        metrics.record(None, res, started, now, now, output)
+                    break
+                except OSError as exc:  # pragma: no cover
+                    if requests:
+                        # the connection was closed by the client
+                        break
+                    print_exception(exc)
+                except Exception as exc:  # pragma: no cover
+                    print_exception(exc)
+                if req is None and requests:  # pragma: no cover
+                    break
+                requests += 1
+
+                if metrics:
+                    parsed = metrics.now()
+                res = await self.dispatch_request(req)
+                if metrics:
+                    handled = metrics.now()
+                if res != Response.already_handled:  # pragma: no branch
+                    if req and req.http_version == '1.1':
+                        res.http_version = '1.1'
+                    res.complete()
+                keep_alive = self.keep_alive(req, res, requests)
+                if res != Response.already_handled:  # pragma: no branch
+                    if keep_alive:
+                        res.headers['Connection'] = 'keep-alive'
+                    elif res.http_version == '1.1':
+                        res.headers['Connection'] = 'close'
+                    await res.write(output)
+                    if metrics:
+                        metrics.record(req, res, started, parsed, handled,
+                                       output)
+                if self.debug and req:  # pragma: no cover
+                    print('{method} {path} {status_code}'.format(
+                        method=req.method, path=req.path,
+                        status_code=res.status_code))
+                if slot:
+                    slot = False
+                    self.release_slot(req)
+                res.release()
+                if req:
+                    req.release()
+                if not keep_alive:
+                    break
+        finally:
+            if slot:
+                self.release_slot(req)
         try:
             await writer.aclose()
         except OSError as exc:  # pragma: no cover
@@ -1341,10 +2224,39 @@ class Microdot:
                 pass
             else:
                 raise
-        if self.debug and req:  # pragma: no cover
-            print('{method} {path} {status_code}'.format(
-                method=req.method, path=req.path,
-                status_code=res.status_code))
+
+    def keep_alive(self, req, res, requests):
+        """Decide if the connection can be reused after sending a response.
+
+        :param req: The request object, or ``None`` if the request could not
+                    be parsed.
+        :param res: The response that is going to be sent for the request.
+        :param requests: The number of requests served on the connection,
+                         including this one.
+
+        A connection is kept open when the client supports persistent
+        connections, the request body was fully read, and the client can find
+        the end of the response body without the connection being closed.
+        """
+        if req is None or res == Response.already_handled or \
+                requests >= self.max_keep_alive_requests:
+            return False
+        connection = req.get_header('Connection', '').lower()
+        if req.http_version == '1.1':
+            if connection == 'close':
+                return False
+        elif connection != 'keep-alive':
+            return False
+        if req.content_length > req.max_body_length or \
+                req.content_length > req.max_content_length or \
+                req.get_header('Transfer-Encoding') is not None:
+            # the request body was not consumed
+            return False
+        if res.headers.get('Connection', '').lower() == 'close':
+            return False
+        return res.is_head or isinstance(res.body, bytes) or \
+            'Content-Length' in res.headers or \
+            res.headers.get('Transfer-Encoding') == 'chunked'
 
     async def dispatch_request(self, req):
         after_request_handled = False
@@ -1374,18 +2286,21 @@ class Microdot:
                             else:
                                 status_code = 200
                                 headers = res[1]
-                            res = Response(body, status_code, headers)
+                            res = Response.acquire(body, status_code, headers)
                         elif not isinstance(res, Response):
-                            res = Response(res)
+                            res = Response.acquire(res)
                         for handler in self.after_request_handlers:
                             res = await invoke_handler(
                                 handler, req, res) or res
                         for handler in req.after_request_handlers:
                             res = await invoke_handler(
                                 handler, req, res) or res
+                        if req.method in ('GET', 'HEAD') and \
+                                isinstance(res, Response):
+                            res.make_conditional(req)
                         after_request_handled = True
                     elif isinstance(f, dict):
-                        res = Response(headers=f)
+                        res = Response.acquire(headers=f)
                     elif f in self.error_handlers:
                         res = await invoke_handler(self.error_handlers[f], req)
                     else:
@@ -1393,6 +2308,8 @@ class Microdot:
                 except HTTPException as exc:
                     if exc.status_code in self.error_handlers:
                         res = self.error_handlers[exc.status_code](req)
+                    elif exc.status_code == 503:
+                        res = self.busy_response()
                     else:
                         res = exc.reason, exc.status_code
                 except Exception as exc:
@@ -1424,9 +2341,9 @@ class Microdot:
             else:
                 res = 'Bad request', 400
         if isinstance(res, tuple):
-            res = Response(*res)
+            res = Response.acquire(*res)
         elif not isinstance(res, Response):
-            res = Response(res)
+            res = Response.acquire(res)
         if not after_request_handled:
             for handler in self.after_error_request_handlers:
                 res = await invoke_handler(
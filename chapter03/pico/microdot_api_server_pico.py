@@ -7,7 +7,13 @@ $ mpremote mount . run microdot_api_server_pico.py
 
 Built and tested with MicroPython Firmware 1.22.1 on Raspberry Pi Pico W
 """
-from microdot import Microdot, send_file                                             # (1)
+import asyncio
+from microdot import Microdot, Response, send_file                                   # (1)
+from microdot.bundle import StaticBundle
+from microdot.cache import StaticCache, JSONCache
+from microdot.metrics import Metrics
+from microdot.sse import with_sse, SSEHub
+from microdot.template import Template
 from picowifi import connect_wifi                                                    # (2)
 from wifi_credentials import SSID, PASSWORD                                          # (3)
 from machine import Pin, PWM                                                         # (4)
@@ -19,11 +25,19 @@ state = {
     'gpio': LED_GPIO
 }
 
+# JSON response for state, only re-encoded after state_cache.bump() is called.
+state_cache = JSONCache(state)
+
 # Pin and PWM to control LED brightness.
 p = Pin(LED_GPIO, Pin.OUT)                                                           # (6)
 pwm = PWM(p)
 pwm.freq(8000)
 
+# LED fade sequences.
+FADE_STEP_MS = 20           # Milliseconds between brightness updates during a fade.
+MAX_KEYFRAMES = 32          # Maximum keyframes accepted by POST /led/sequence.
+MAX_KEYFRAME_MS = 60000     # Maximum duration of a keyframe.
+
 # Connect to WiFi and get Pico W's IP Address.
 ip = connect_wifi(SSID, PASSWORD)                                                    # (7)
 
@@ -53,11 +67,38 @@ else:
     # Create Microdot server instance
     app = Microdot()                                                                 # (11)
 
+    # Keep small static files in RAM, and answer repeat
+    # requests with 304 Not Modified. Files larger than max_file_size
+    # (like jquery.min.js) are still streamed from flash.
+    Response.static_cache = StaticCache(max_size=16 * 1024, max_file_size=8 * 1024)
+
+    # Serve static files from a single bundle file, when one was created with
+    # picotools/bundle_static.py and copied to the Pico, else from the static
+    # folder. The bundle is opened once and its index is kept in RAM.
+    try:
+        static_bundle = StaticBundle('static.bundle')
+    except OSError:
+        static_bundle = None
+
+    # Limit how many requests are handled at once so a burst of clients
+    # cannot exhaust the Pico W's memory. Extra requests wait briefly for a
+    # free slot, or receive 503 Service Unavailable with a Retry-After header.
+    # Idle persistent connections do not use a slot, and each open web page's
+    # event stream or Web Socket counts against its own, separate limit.
+    app.max_concurrent_requests = 8
+    app.max_streaming_connections = 4
+
+    # Record request counts, status codes, timings, bytes sent and free heap.
+    # They can be read at http://<ip>:5000/metrics (Prometheus text format).
+    Metrics(app)
+
     # HTTP GET default route.
     # This could alternativly be written as @app.route('/', methods=['GET'])
     @app.get('/')                                                                    # (12)
     async def index(request):
-        return send_file('static/index_api_client.html')
+        # Render the page with the current LED state. The template is compiled
+        # on first use, and the page is streamed as it is rendered.
+        return Template('index_api_client.html').response(state=state)
     
     # HTTP GET route for serving static content.
     # This could alternativly be written as
@@ -67,14 +108,76 @@ else:
         if '..' in path:
             # Directory traversal is not allowed
             return 'Not found', 404
-        return send_file('static/' + path, max_age=86400)
+        if static_bundle:
+            return static_bundle.send_file(path, request=request, max_age=86400) or ('Not found', 404)
+        # compressed='auto' serves static/<path>.gz (if present) to browsers that
+        # accept gzip. Create the .gz files with picotools/gzip_static.py
+        return send_file('static/' + path, max_age=86400, compressed='auto', request=request)
 
     # HTTP GET route for getting LED state and GPIO.
     # This could alternativly be written as
     # @app.route('/led', methods=['GET'])
     @app.get('/led')                                                                 # (14)
     async def led_get(request):
-        return state
+        # Unchanged state is answered with 304 Not Modified, without a body.
+        return state_cache.response()
+
+    # Server-Sent Events hub, used to push LED state changes to every
+    # connected web page, so they do not need to poll GET /led.
+    state_events = SSEHub()
+
+    # HTTP GET route for a stream of LED state events.
+    # In the Web Page (JavaScript) we connect to the stream using:
+    #   const events = new EventSource('/events')
+    @app.get('/events')
+    @with_sse
+    async def events(request, sse):
+        await sse.send(state_cache.encode()[0]) # Send the current state on connection.
+        await state_events.subscribe(sse)   # Returns when the client disconnects.
+
+    def update_state(level):
+        """ Set LED brightness and send the new state to connected web pages """
+        state['level'] = level
+        state_cache.bump()
+        set_led_brightness(level)
+        state_events.publish(state_cache.encode()[0])
+
+    # Task running the current POST /led/sequence fade, if any.
+    sequence_task = None
+
+    def stop_sequence():
+        """ Cancel a running fade sequence """
+        global sequence_task
+        if sequence_task is not None:
+            sequence_task.cancel()
+            sequence_task = None
+
+    async def play_sequence(keyframes):
+        """ Fade the LED through a list of (level, duration in ms) keyframes """
+        global sequence_task
+        try:
+            for level, duration in keyframes:
+                start = state['level']
+                steps = duration // FADE_STEP_MS
+
+                # Interpolate between keyframes on the Pico, rather than
+                # receiving a request for every step.
+                for step in range(1, steps):
+                    current = start + (level - start) * step / steps
+                    set_led_brightness(current)
+
+                    # Keep GET /led up to date, but only publish state to
+                    # web pages at the end of each keyframe.
+                    state['level'] = round(current)
+                    state_cache.bump()
+                    await asyncio.sleep(FADE_STEP_MS / 1000)
+
+                update_state(level)
+                if steps:
+                    await asyncio.sleep(FADE_STEP_MS / 1000)
+        finally:
+            if sequence_task is asyncio.current_task():
+                sequence_task = None
 
     # HTTP POST route for setting LED state.
     # This could alternativly be written as
@@ -93,8 +196,40 @@ else:
             return "property 'level' expected, and must be between 0 and 100", 400
 
         # Update state and set LED brightness.
-        state['level'] = level
-        set_led_brightness(level)
-        return state
+        stop_sequence()
+        update_state(level)
+        return state_cache.response()
+
+    # HTTP POST route for fading the LED through a sequence of keyframes.
+    # The request body is JSON, for example to fade up to 100% over 1 second,
+    # then down to 0% over half a second:
+    #   {"keyframes": [[100, 1000], [0, 500]]}
+    @app.post('/led/sequence')
+    async def led_sequence_post(request):
+        global sequence_task
+        error = "property 'keyframes' expected, a list of up to {} [level, duration] " \
+                "pairs with level between 0 and 100 and duration between 0 and {} ms" \
+                .format(MAX_KEYFRAMES, MAX_KEYFRAME_MS)
+
+        keyframes = request.json.get('keyframes') if isinstance(request.json, dict) else None
+        if not isinstance(keyframes, list) or not 0 < len(keyframes) <= MAX_KEYFRAMES:
+            return error, 400
+
+        try:
+            keyframes = [(int(level), int(duration)) for level, duration in keyframes]
+        except (TypeError, ValueError):
+            return error, 400
+
+        for level, duration in keyframes:
+            if level < 0 or level > 100 or duration < 0 or duration > MAX_KEYFRAME_MS:
+                return error, 400
+
+        # Replace any sequence that is already running.
+        stop_sequence()
+        sequence_task = asyncio.create_task(play_sequence(keyframes))
+        return {
+            'keyframes': len(keyframes),
+            'duration': sum(duration for level, duration in keyframes)
+        }, 202
 
     app.run(host=ip, debug=True)                                                     # (16)
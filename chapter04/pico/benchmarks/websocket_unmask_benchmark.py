@@ -0,0 +1,95 @@
+"""
+chapter04/pico/benchmarks/websocket_unmask_benchmark.py
+
+Measure the throughput, in MB/s, of unmasking WebSocket payloads received
+from clients, for a few payload sizes:
+
+* per byte: the Python generator that microdot.websocket used before,
+  bytes(x ^ mask[i % 4] for i, x in enumerate(payload))
+* blocks: microdot.websocket's Python code, which XORs blocks of the payload
+  with the repeated key as single integers
+* viper: microdot.native.unmask_words, which XORs 32-bit words in native
+  code (MicroPython builds with the viper code emitter only)
+
+Run from the chapter04/pico folder with CPython:
+
+$ python3 benchmarks/websocket_unmask_benchmark.py
+
+or with MicroPython on the Pico:
+
+$ mpremote mount . run benchmarks/websocket_unmask_benchmark.py
+"""
+import sys
+import time
+
+sys.path.insert(0, '.')
+
+from microdot.websocket import _unmask_blocks  # noqa: E402
+
+try:
+    from microdot.native import unmask_words
+except (ImportError, SyntaxError):
+    unmask_words = None
+
+SIZES = [125, 1024, 16384]
+TOTAL_BYTES = 256 * 1024
+MASK = b'\x37\xfa\x21\x3d'
+
+try:
+    ticks_us = time.ticks_us
+    ticks_diff = time.ticks_diff
+except AttributeError:
+    def ticks_us():
+        return int(time.perf_counter() * 1000000)
+
+    def ticks_diff(end, start):
+        return end - start
+
+
+def per_byte(buf, mask):
+    buf[:] = bytes(x ^ mask[i % 4] for i, x in enumerate(buf))
+
+
+def blocks(buf, mask):
+    _unmask_blocks(buf, mask)
+
+
+def viper(buf, mask):
+    unmask_words(buf, len(buf), mask)
+
+
+def throughput(function, size):
+    """ Unmask TOTAL_BYTES bytes in payloads of size bytes. Returns MB/s. """
+    buf = bytearray(i & 0xff for i in range(size))
+    count = max(TOTAL_BYTES // size, 1)
+    start = ticks_us()
+    for _ in range(count):
+        function(buf, MASK)
+    elapsed = ticks_diff(ticks_us(), start)
+    return count * size / max(elapsed, 1)
+
+
+def check(function):
+    """ Confirm that function unmasks like the per byte code. """
+    payload = bytearray(i & 0xff for i in range(1027))
+    expected = bytes(x ^ MASK[i % 4] for i, x in enumerate(payload))
+    function(payload, MASK)
+    return bytes(payload) == expected
+
+
+def main():
+    functions = [('per byte', per_byte), ('blocks', blocks)]
+    if unmask_words is not None:
+        functions.append(('viper', viper))
+    print('platform: {} {}'.format(sys.implementation.name, sys.platform))
+    print('{:<10}'.format('MB/s') + ''.join(
+        '{:>10}'.format(size) for size in SIZES))
+    for name, function in functions:
+        if not check(function):
+            print('{:<10} wrong result'.format(name))
+            continue
+        print('{:<10}'.format(name) + ''.join(
+            '{:>10.2f}'.format(throughput(function, size)) for size in SIZES))
+
+
+main()
@@ -0,0 +1,140 @@
+import json
+import struct
+from microdot import Response
+
+MAGIC = b'MDB1'
+
+
+class BundleReader:
+    """A read-only view of one asset in a bundle file.
+
+    Several responses can stream from the same bundle at the same time, so
+    the reader keeps its own position and seeks before every read.
+    """
+    def __init__(self, f, offset, length):
+        self.f = f
+        self.pos = offset
+        self.remaining = length
+
+    def readinto(self, buf):
+        if self.remaining <= 0:
+            return 0
+        if len(buf) > self.remaining:
+            buf = memoryview(buf)[:self.remaining]
+        self.f.seek(self.pos)
+        n = self.f.readinto(buf) or 0
+        if n == 0:
+            # the bundle file is shorter than its index says
+            self.remaining = 0
+        self.pos += n
+        self.remaining -= n
+        return n
+
+    def read(self, n=-1):
+        if n < 0 or n > self.remaining:
+            n = self.remaining
+        self.f.seek(self.pos)
+        data = self.f.read(n)
+        self.pos += len(data)
+        self.remaining -= len(data)
+        return data
+
+    def close(self):
+        # the bundle file is shared and stays open
+        pass
+
+
+class StaticBundle:
+    """Serve static files from a bundle created with
+    ``picotools/bundle_static.py``.
+
+    :param filename: The bundle file.
+
+    The bundle file is opened once, and its index is loaded into a
+    dictionary, so that finding an asset does not need the filesystem.
+    Assets are served with the ``ETag`` recorded in the bundle, so clients
+    that send a matching ``If-None-Match`` header receive a ``304``
+    response. A gzip compressed copy is sent to clients that accept it when
+    the bundle has one, and single byte ranges are supported as in
+    :meth:`send_file() <microdot.Response.send_file>`.
+
+    Example::
+
+        from microdot.bundle import StaticBundle
+
+        bundle = StaticBundle('static.bundle')
+
+        @app.get('/static/<path:path>')
+        async def static(request, path):
+            return bundle.send_file(path, request=request, max_age=86400) \\
+                or ('Not found', 404)
+    """
+    def __init__(self, filename):
+        self.file = open(filename, 'rb')
+        if self.file.read(4) != MAGIC:
+            self.file.close()
+            raise ValueError('Not a static bundle: ' + filename)
+        length = struct.unpack('>I', self.file.read(4))[0]
+        base = 8 + length
+        #: The assets in the bundle, as a dictionary that maps each name to
+        #: a list with the uncompressed and gzip compressed entries. Each
+        #: entry is an ``(offset, length, content type, etag)`` tuple, or
+        #: ``None``.
+        self.index = {}
+        for name, offset, size, content_type, etag, gzip in json.loads(
+                self.file.read(length).decode()):
+            entry = self.index.setdefault(name, [None, None])
+            entry[1 if gzip else 0] = (base + offset, size, content_type,
+                                       etag)
+
+    def send_file(self, name, request=None, max_age=None):
+        """Return a response that sends an asset from the bundle, or
+        ``None`` if the bundle does not have the asset.
+
+        :param name: The name of the asset, relative to the bundled folder.
+        :param request: The request object. When given, a gzip compressed
+                        copy of the asset is sent to clients that accept
+                        it, and the ``Range`` header is honored.
+        :param max_age: The ``Cache-Control`` header's ``max-age`` value in
+                        seconds. If omitted, the value of the
+                        :attr:`Response.default_send_file_max_age` attribute
+                        is used.
+        """
+        entry = self.index.get(name)
+        if entry is None:
+            return None
+        asset = entry[0]
+        headers = {}
+        if entry[1] is not None:
+            headers['Vary'] = 'Accept-Encoding'
+            if request is not None and request.accepts_encoding('gzip'):
+                asset = entry[1]
+                headers['Content-Encoding'] = 'gzip'
+        offset, size, content_type, etag = asset
+        headers['Content-Type'] = content_type
+        headers['ETag'] = etag
+        headers['Accept-Ranges'] = 'bytes'
+        headers['Content-Length'] = str(size)
+        if max_age is None:
+            max_age = Response.default_send_file_max_age
+        if max_age is not None:
+            headers['Cache-Control'] = 'max-age={}'.format(max_age)
+
+        byte_range = None
+        if request is not None:
+            byte_range = request.get_header('Range')
+            if byte_range:
+                byte_range = Response._parse_range(byte_range, size)
+        if byte_range is False:
+            return Response._range_response(b'', 200, headers, False, size)
+        length = size
+        if byte_range:
+            offset += byte_range[0]
+            length = byte_range[1] - byte_range[0] + 1
+        return Response._range_response(
+            BundleReader(self.file, offset, length), 200, headers,
+            byte_range, size)
+
+    def close(self):
+        """Close the bundle file."""
+        self.file.close()
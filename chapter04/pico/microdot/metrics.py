@@ -0,0 +1,213 @@
+import gc
+import time
+from microdot import Response
+
+try:
+    from time import ticks_us, ticks_diff
+except ImportError:  # pragma: no cover
+    def ticks_us():
+        return int(time.perf_counter() * 1000000)
+
+    def ticks_diff(end, start):
+        return end - start
+
+PHASES = ('parse', 'handler', 'write')
+
+
+class CountingStream:
+    """Output stream wrapper that counts the bytes written to it."""
+    def __init__(self, stream):
+        self.stream = stream
+        self.count = 0
+
+    async def awrite(self, data):
+        self.count += len(data)
+        await self.stream.awrite(data)
+
+    async def aclose(self):
+        await self.stream.aclose()
+
+
+class Metrics:
+    """Request metrics for a Microdot application, served in the Prometheus
+    text format.
+
+    :param app: The application to record metrics for.
+    :param url: The URL of the route that serves the metrics. Set to ``None``
+                to not register a route, for example to serve the metrics
+                from a route of the application with :meth:`render`.
+
+    For each route the number of requests, and histograms of the time spent
+    parsing the request, running the handler and writing the response are
+    recorded. The number of responses by status code, the bytes sent and the
+    free heap are also reported. Requests that do not match a route are
+    recorded with an empty ``route`` label.
+
+    The write time of streamed responses, such as Server-Sent Events, is the
+    time the stream was open.
+
+    Example::
+
+        from microdot import Microdot
+        from microdot.metrics import Metrics
+
+        app = Microdot()
+        Metrics(app)  # metrics are available at /metrics
+    """
+    #: The upper bounds of the latency histogram buckets, in microseconds.
+    buckets = (1000, 5000, 10000, 25000, 50000, 100000, 250000, 500000,
+               1000000, 2500000)
+
+    def __init__(self, app, url='/metrics'):
+        self.app = app
+        self.routes = {}  # route: [requests, parse, handler, write]
+        self.status_codes = {}
+        self.bytes_out = 0
+        app.metrics = self
+        if url:
+            app.get(url)(self.handler)
+
+    def now(self):
+        """Return a timestamp in microseconds, used to time request
+        phases."""
+        return ticks_us()
+
+    def stream(self, writer):
+        """Return a wrapper for a connection's output stream that counts the
+        bytes that are written to it."""
+        return CountingStream(writer)
+
+    def record(self, req, res, started, parsed, handled, stream):
+        """Record a request that was handled.
+
+        :param req: The request object, or ``None`` if the request could not
+                    be parsed.
+        :param res: The response that was sent.
+        :param started: The timestamp at which the request started to be
+                        read.
+        :param parsed: The timestamp at which the request was parsed.
+        :param handled: The timestamp at which the response was ready.
+        :param stream: The stream returned by :meth:`stream` for the
+                       connection.
+        """
+        written = self.now()
+        route = (req.url_rule if req else None) or ''
+        entry = self.routes.get(route)
+        if entry is None:
+            entry = [0] + [self._histogram() for _ in PHASES]
+            self.routes[route] = entry
+        entry[0] += 1
+        self._observe(entry[1], ticks_diff(parsed, started))
+        self._observe(entry[2], ticks_diff(handled, parsed))
+        self._observe(entry[3], ticks_diff(written, handled))
+        self.status_codes[res.status_code] = \
+            self.status_codes.get(res.status_code, 0) + 1
+        self.bytes_out += stream.count
+        stream.count = 0
+
+    def _histogram(self):
+        # bucket counts, followed by the +Inf count and the sum
+        return [0] * (len(self.buckets) + 2)
+
+    def _observe(self, histogram, value):
+        i = 0
+        for bound in self.buckets:
+            if value <= bound:
+                break
+            i += 1
+        histogram[i] += 1
+        histogram[-1] += value
+
+    def render(self):
+        """Return the metrics in the Prometheus text exposition format, as a
+        list of lines."""
+        lines = [
+            '# HELP microdot_requests_total Requests handled, by route.',
+            '# TYPE microdot_requests_total counter',
+        ]
+        for route, entry in self.routes.items():
+            lines.append('microdot_requests_total{{route="{}"}} {}'.format(
+                route, entry[0]))
+        lines += [
+            '# HELP microdot_responses_total Responses sent, by status code.',
+            '# TYPE microdot_responses_total counter',
+        ]
+        for status_code, count in self.status_codes.items():
+            lines.append('microdot_responses_total{{code="{}"}} {}'.format(
+                status_code, count))
+        lines += [
+            '# HELP microdot_request_duration_seconds Time spent in each '
+            'phase of a request, by route.',
+            '# TYPE microdot_request_duration_seconds histogram',
+        ]
+        for route, entry in self.routes.items():
+            for i, phase in enumerate(PHASES):
+                histogram = entry[i + 1]
+                labels = 'route="{}",phase="{}"'.format(route, phase)
+                count = 0
+                for bound, n in zip(self.buckets, histogram):
+                    count += n
+                    lines.append(
+                        'microdot_request_duration_seconds_bucket'
+                        '{{{},le="{}"}} {}'.format(labels, bound / 1000000,
+                                                   count))
+                count += histogram[-2]
+                lines += [
+                    'microdot_request_duration_seconds_bucket'
+                    '{{{},le="+Inf"}} {}'.format(labels, count),
+                    'microdot_request_duration_seconds_sum{{{}}} {}'.format(
+                        labels, histogram[-1] / 1000000),
+                    'microdot_request_duration_seconds_count{{{}}} {}'.format(
+                        labels, count),
+                ]
+        lines += [
+            '# HELP microdot_response_bytes_total Bytes sent in responses.',
+            '# TYPE microdot_response_bytes_total counter',
+            'microdot_response_bytes_total {}'.format(self.bytes_out),
+            '# HELP microdot_active_connections Requests being handled.',
+            '# TYPE microdot_active_connections gauge',
+            'microdot_active_connections {}'.format(self.app.active_requests),
+            '# HELP microdot_streaming_connections Open WebSocket and event '
+            'stream connections.',
+            '# TYPE microdot_streaming_connections gauge',
+            'microdot_streaming_connections {}'.format(
+                self.app.streaming_connections),
+            '# HELP microdot_rejected_connections_total Connections rejected '
+            'with a 503 response.',
+            '# TYPE microdot_rejected_connections_total counter',
+            'microdot_rejected_connections_total {}'.format(
+                self.app.rejected_requests),
+            '# HELP microdot_header_timeouts_total Connections closed because '
+            'the request head was not received in time.',
+            '# TYPE microdot_header_timeouts_total counter',
+            'microdot_header_timeouts_total {}'.format(
+                self.app.header_timeouts),
+            '# HELP microdot_body_timeouts_total Connections closed because '
+            'the request body was not received in time.',
+            '# TYPE microdot_body_timeouts_total counter',
+            'microdot_body_timeouts_total {}'.format(self.app.body_timeouts),
+            '# HELP microdot_idle_timeouts_total Persistent connections '
+            'closed after being idle.',
+            '# TYPE microdot_idle_timeouts_total counter',
+            'microdot_idle_timeouts_total {}'.format(self.app.idle_timeouts),
+        ]
+        if hasattr(gc, 'mem_free'):  # pragma: no cover
+            lines += [
+                '# HELP microdot_free_heap_bytes Free heap memory.',
+                '# TYPE microdot_free_heap_bytes gauge',
+                'microdot_free_heap_bytes {}'.format(gc.mem_free()),
+            ]
+            if self.app.min_free_heap is not None:
+                lines += [
+                    '# HELP microdot_min_free_heap_bytes Lowest free heap '
+                    'memory seen when a connection was accepted.',
+                    '# TYPE microdot_min_free_heap_bytes gauge',
+                    'microdot_min_free_heap_bytes {}'.format(
+                        self.app.min_free_heap),
+                ]
+        return lines
+
+    async def handler(self, request):
+        """Route handler that returns the metrics."""
+        return Response('\n'.join(self.render()) + '\n', headers={
+            'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'})
@@ -0,0 +1,217 @@
+import asyncio
+from microdot.microdot import Request, HTTPException
+
+
+class FileUpload:
+    """A file submitted in a ``multipart/form-data`` request body.
+
+    The contents of the file are not stored. They are read from the request
+    in chunks of at most :attr:`FormDataIter.chunk_size` bytes, by iterating
+    over this object or calling :meth:`save`. Any data that is not read is
+    skipped when the next part of the form is requested.
+    """
+    def __init__(self, form, name, filename, content_type):
+        #: The name of the form field.
+        self.name = name
+        #: The filename given by the client. This value is not sanitized.
+        self.filename = filename
+        #: The content type given by the client, or ``None``.
+        self.content_type = content_type
+        #: The number of bytes read so far.
+        self.size = 0
+        self.form = form
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        chunk = b''
+        while not chunk:
+            chunk = await self.form._read_part()
+            if chunk is None:
+                raise StopAsyncIteration
+        self.size += len(chunk)
+        return chunk
+
+    async def save(self, path):
+        """Write the file to storage, one chunk at a time.
+
+        :param path: The path of the file to write.
+
+        Returns the size of the file.
+        """
+        with open(path, 'wb') as f:
+            async for chunk in self:
+                f.write(chunk)
+        return self.size
+
+
+class FormDataIter:
+    """Parse a ``multipart/form-data`` request body incrementally.
+
+    :param request: The request object.
+
+    Iterating over this object returns ``(name, value)`` tuples for the parts
+    of the form, in the order in which they were sent. The value of a regular
+    field is a string. The value of a file is a :class:`FileUpload` object
+    that must be consumed before moving to the next part, else its contents
+    are skipped.
+
+    No more than ``chunk_size`` bytes of the body, plus a small overlap to
+    detect part boundaries, are held in memory at any time, regardless of the
+    size of the upload. Requests that are larger than
+    ``Request.max_content_length`` are rejected before they reach the route,
+    so this limit must be increased to accept large uploads.
+
+    A ``400`` error is raised if the body is not a valid form submission, and
+    a ``413`` error if a regular field is larger than ``max_field_length``.
+
+    Example::
+
+        from microdot import Request
+        from microdot.multipart import FormDataIter, FileUpload
+
+        Request.max_content_length = 512 * 1024
+
+        @app.post('/upload')
+        async def upload(request):
+            async for name, value in FormDataIter(request):
+                if isinstance(value, FileUpload):
+                    await value.save('/uploads/' + name)
+            return 'OK'
+    """
+    #: The maximum number of bytes read from the request at a time.
+    chunk_size = 512
+
+    #: The maximum size of a regular (non-file) form field, in bytes.
+    max_field_length = 1024
+
+    #: The maximum size of the headers of a part, in bytes.
+    max_headers_length = 1024
+
+    def __init__(self, request):
+        self.request = request
+        self.stream = request.stream
+        self.remaining = request.content_length
+        self.delimiter = None
+        content_type = (request.content_type or '').split(';')
+        if content_type[0].strip().lower() == 'multipart/form-data':
+            for param in content_type[1:]:
+                param = param.strip().split('=', 1)
+                if param[0].lower() == 'boundary' and len(param) == 2:
+                    self.delimiter = b'\r\n--' + param[1].strip('"').encode()
+        if self.delimiter is None:
+            raise HTTPException(400, 'Expected multipart/form-data body')
+        # the body starts with the boundary, without the preceding CRLF
+        self.buffer = b'\r\n'
+        self.part_done = False
+        self.done = False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self.done:
+            raise StopAsyncIteration
+        # skip the preamble, or the unread contents of the previous part
+        while await self._read_part() is not None:
+            pass
+        headers = await self._read_part_headers()
+        if headers is None:
+            self.done = True
+            raise StopAsyncIteration
+        name, filename, content_type = self._parse_part_headers(headers)
+        if filename is not None:
+            return name, FileUpload(self, name, filename, content_type)
+        value = b''
+        while True:
+            chunk = await self._read_part()
+            if chunk is None:
+                break
+            value += chunk
+            if len(value) > self.max_field_length:
+                raise HTTPException(413, 'Form field too large')
+        return name, value.decode()
+
+    async def _fill(self):
+        # read more of the body into the buffer
+        if self.remaining <= 0:
+            return False
+        try:
+            data = await Request._with_timeout(
+                self.stream.read(min(self.chunk_size, self.remaining)),
+                Request.body_timeout)
+        except asyncio.TimeoutError:
+            self.request.app.body_timeouts += 1
+            raise HTTPException(408, 'Request timeout')
+        if not data:
+            self.remaining = 0
+            return False
+        self.remaining -= len(data)
+        self.buffer += data
+        return True
+
+    async def _read_part(self):
+        # return the next chunk of the current part, or None at its end
+        if self.part_done:
+            return None
+        keep = len(self.delimiter) - 1
+        while True:
+            i = self.buffer.find(self.delimiter)
+            if i >= 0:
+                chunk = self.buffer[:i]
+                self.buffer = self.buffer[i + len(self.delimiter):]
+                self.part_done = True
+                return chunk
+            if len(self.buffer) >= self.chunk_size + keep:
+                # the end of the buffer could be the start of a delimiter
+                chunk = self.buffer[:-keep]
+                self.buffer = self.buffer[-keep:]
+                return chunk
+            if not await self._fill():
+                raise HTTPException(400, 'Incomplete form data')
+
+    async def _read_part_headers(self):
+        # return the raw headers of the next part, or None after the last
+        while len(self.buffer) < 2:
+            if not await self._fill():
+                raise HTTPException(400, 'Incomplete form data')
+        if self.buffer[:2] == b'--':
+            return None
+        while True:
+            i = self.buffer.find(b'\r\n\r\n')
+            if i >= 0:
+                break
+            if len(self.buffer) > self.max_headers_length:
+                raise HTTPException(400, 'Form part headers too large')
+            if not await self._fill():
+                raise HTTPException(400, 'Incomplete form data')
+        headers = self.buffer[:i]
+        self.buffer = self.buffer[i + 4:]
+        self.part_done = False
+        return headers
+
+    @staticmethod
+    def _parse_part_headers(headers):
+        name = None
+        filename = None
+        content_type = None
+        for line in headers.decode().split('\r\n'):
+            if ':' not in line:
+                continue
+            header, value = line.split(':', 1)
+            header = header.strip().lower()
+            if header == 'content-type':
+                content_type = value.strip()
+            elif header == 'content-disposition':
+                for param in value.split(';')[1:]:
+                    param = param.strip().split('=', 1)
+                    if len(param) != 2:
+                        continue
+                    if param[0].lower() == 'name':
+                        name = param[1].strip('"')
+                    elif param[0].lower() == 'filename':
+                        filename = param[1].strip('"')
+        if name is None:
+            raise HTTPException(400, 'Form part without a name')
+        return name, filename, content_type
@@ -0,0 +1,22 @@
+"""Native code versions of Microdot's inner loops, for MicroPython.
+
+This module can only be imported by MicroPython builds that have the viper
+code emitter, such as the Raspberry Pi Pico W firmware. Modules that use it
+fall back to Python code when the import fails.
+"""
+import micropython
+
+
+@micropython.viper
+def unmask_words(buf, length: int, mask):
+    """XOR ``length`` bytes of ``buf`` in place with the 4 byte WebSocket
+    masking key ``mask``, one 32-bit word at a time."""
+    m = ptr8(mask)  # noqa: F821
+    key = m[0] | (m[1] << 8) | (m[2] << 16) | (m[3] << 24)
+    words = ptr32(buf)  # noqa: F821
+    n = length >> 2
+    for i in range(n):
+        words[i] = words[i] ^ key
+    data = ptr8(buf)  # noqa: F821
+    for i in range(n << 2, length):
+        data[i] = data[i] ^ m[i & 3]
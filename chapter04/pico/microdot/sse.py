@@ -0,0 +1,200 @@
+import asyncio
+import json
+from microdot import Response
+from microdot.microdot import print_exception
+from microdot.helpers import wraps
+
+
+def encode_event(data, event=None, event_id=None):
+    """Encode a Server-Sent Event as bytes.
+
+    :param data: the event payload, given as a string, bytes or a value that
+                 can be serialized to JSON.
+    :param event: an optional event name.
+    :param event_id: an optional event id.
+    """
+    if isinstance(data, (dict, list)):
+        data = json.dumps(data)
+    elif isinstance(data, bytes):
+        data = data.decode()
+    elif not isinstance(data, str):
+        data = str(data)
+    message = ''
+    if event_id is not None:
+        message += 'id: {}\n'.format(event_id)
+    if event:
+        message += 'event: {}\n'.format(event)
+    for line in data.split('\n'):
+        message += 'data: {}\n'.format(line)
+    return (message + '\n').encode()
+
+
+class SSE:
+    """Server-Sent Events object.
+
+    An object of this class is sent to handler functions to manage the SSE
+    connection.
+    """
+    #: The maximum number of events waiting to be sent to the client. When
+    #: the client falls behind, the oldest events are dropped.
+    max_queue = 16
+
+    #: The number of seconds without events after which a comment line is
+    #: sent to the client, to detect disconnected clients and to prevent
+    #: proxies from closing the connection. Set to ``None`` to disable.
+    ping_interval = 15
+
+    def __init__(self):
+        self.event = asyncio.Event()
+        self.queue = []
+        self.dropped = 0
+
+    async def send(self, data, event=None, event_id=None):
+        """Send an event to the client.
+
+        :param data: the event payload, given as a string, bytes or a value
+                     that can be serialized to JSON.
+        :param event: an optional event name.
+        :param event_id: an optional event id.
+        """
+        self.put(encode_event(data, event=event, event_id=event_id))
+
+    def put(self, message):
+        """Queue an event that was already encoded with
+        :func:`encode_event`."""
+        self.queue.append(message)
+        if len(self.queue) > self.max_queue:
+            self.queue.pop(0)
+            self.dropped += 1
+        self.event.set()
+
+
+class SSEHub:
+    """Fan out events to multiple Server-Sent Events clients.
+
+    Each event is encoded once and queued for every subscribed client.
+
+    Example::
+
+        hub = SSEHub()
+
+        @app.route('/events')
+        @with_sse
+        async def events(request, sse):
+            await hub.subscribe(sse)
+
+        @app.post('/led')
+        async def led(request):
+            # ...
+            hub.publish(state)
+    """
+    def __init__(self):
+        self.subscribers = []
+
+    async def subscribe(self, sse):
+        """Add a client to the hub. This coroutine returns when the client
+        disconnects."""
+        self.subscribers.append(sse)
+        try:
+            await asyncio.Event().wait()
+        finally:
+            self.subscribers.remove(sse)
+
+    def publish(self, data, event=None, event_id=None):
+        """Send an event to all the subscribed clients.
+
+        :param data: the event payload, given as a string, bytes or a value
+                     that can be serialized to JSON.
+        :param event: an optional event name.
+        :param event_id: an optional event id.
+        """
+        if not self.subscribers:
+            return
+        message = encode_event(data, event=event, event_id=event_id)
+        for sse in self.subscribers:
+            sse.put(message)
+
+
+def sse_response(request, event_function, *args, **kwargs):
+    """Return a response object that initiates an event stream.
+
+    :param request: the request object.
+    :param event_function: an asynchronous function that will send events to
+                           the client. The function is invoked with ``request``
+                           and an ``sse`` object. The function should use
+                           ``sse.send()`` to send events to the client.
+    :param args: additional positional arguments to be passed to the response.
+    :param kwargs: additional keyword arguments to be passed to the response.
+
+    The event stream counts against the application's
+    ``max_streaming_connections`` limit, and a ``503`` response is returned
+    instead when the limit is reached.
+    """
+    if not request.app.start_stream(request):
+        return request.app.busy_response()
+    sse = SSE()
+
+    async def sse_task_wrapper():
+        try:
+            await event_function(request, sse, *args, **kwargs)
+        except asyncio.CancelledError:  # pragma: no cover
+            pass
+        except Exception as exc:
+            print_exception(exc)
+        sse.event.set()
+
+    class sse_loop:
+        def __init__(self):
+            self.task = None
+
+        def __aiter__(self):
+            return self
+
+        async def __anext__(self):
+            if self.task is None:
+                # the event function starts when the body is first read,
+                # after the headers were sent, so that nothing is left
+                # running for HEAD requests or clients that disconnect early
+                self.task = asyncio.create_task(sse_task_wrapper())
+            while not sse.queue:
+                if self.task.done():
+                    raise StopAsyncIteration
+                try:
+                    if sse.ping_interval:
+                        await asyncio.wait_for(sse.event.wait(),
+                                               sse.ping_interval)
+                    else:
+                        await sse.event.wait()
+                except asyncio.TimeoutError:
+                    return b': ping\n\n'
+                sse.event.clear()
+            return sse.queue.pop(0)
+
+        async def aclose(self):
+            if self.task is not None:
+                self.task.cancel()
+
+    return Response(body=sse_loop(),
+                    headers={'Content-Type': 'text/event-stream',
+                             'Cache-Control': 'no-cache'})
+
+
+def with_sse(f):
+    """Decorator to make a route a Server-Sent Events endpoint.
+
+    This decorator is used to define a route that accepts SSE connections. The
+    route then receives a sse object as a second argument that it can use to
+    send events to the client::
+
+        @app.route('/events')
+        @with_sse
+        async def events(request, sse):
+            for i in range(10):
+                await asyncio.sleep(1)
+                await sse.send(f'{i}')
+    """
+    @wraps(f)
+    async def sse_handler(request, *args, **kwargs):
+        return sse_response(request, f, *args, **kwargs)
+
+    return sse_handler
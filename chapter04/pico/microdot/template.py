@@ -0,0 +1,195 @@
+from microdot import Response
+
+
+def escape(value):
+    """Return a value converted to a string that is safe to include in
+    HTML."""
+    if isinstance(value, int):
+        return str(value)
+    return str(value).replace('&', '&amp;').replace('<', '&lt;') \
+        .replace('>', '&gt;').replace('"', '&quot;').replace("'", '&#39;')
+
+
+class TemplateError(Exception):
+    """Exception raised for templates that cannot be compiled."""
+    pass
+
+
+class Template:
+    """A compiled template.
+
+    :param name: The filename of the template, relative to
+                 ``templates_dir``.
+
+    The template is compiled into a Python generator function the first
+    time it is used, and the function is kept in ``cache``, so that later
+    renders only run the compiled code. Templates support the following
+    syntax, where expressions are Python expressions:
+
+    - ``{% args name1, name2 %}``: the arguments of the template. This must
+      come before any other content. Arguments can have default values.
+    - ``{{ expression }}``: the value of the expression, HTML escaped. Use
+      ``{{ expression|safe }}`` to include the value unescaped.
+    - ``{% if expression %}``, ``{% elif expression %}``, ``{% else %}`` and
+      ``{% endif %}``.
+    - ``{% for target in expression %}`` and ``{% endfor %}``.
+    - ``{# comment #}``.
+
+    Example::
+
+        from microdot.template import Template
+
+        @app.get('/')
+        async def index(request):
+            return Template('index.html').response(state=state)
+
+    With ``templates/index.html``::
+
+        {% args state %}
+        <p>Brightness: {{ state['level'] }}%</p>
+    """
+    #: The folder where templates are stored.
+    templates_dir = 'templates'
+
+    #: Small pieces of output are joined into chunks of about this size, in
+    #: bytes. Larger pieces of text from the template are returned as they
+    #: are.
+    chunk_size = 512
+
+    #: Compiled templates, by name. Clear this dictionary to reload
+    #: templates that were changed.
+    cache = {}
+
+    def __init__(self, name):
+        self.name = name
+        self.render_function = Template.cache.get(name)
+        if self.render_function is None:
+            with open(self.templates_dir + '/' + name) as f:
+                source = f.read()
+            self.render_function = self.compile(source, name)
+            Template.cache[name] = self.render_function
+
+    @staticmethod
+    def compile(source, name='<template>'):
+        """Compile template source code into a generator function.
+
+        :param source: The template source code.
+        :param name: The name of the template, used in error messages.
+        """
+        args = ''
+        code = []
+        blocks = []
+        pos = 0
+        while pos < len(source):
+            start = source.find('{', pos)
+            while start != -1 and source[start + 1:start + 2] not in '{%#':
+                start = source.find('{', start + 1)
+            if start == -1 or start == len(source) - 1:
+                start = len(source)
+            if start > pos:
+                # text is stored as bytes, so that it is sent without
+                # being copied or encoded
+                code.append('    ' * (len(blocks) + 1) + 'yield ' +
+                            repr(source[pos:start].encode()))
+            if start == len(source):
+                break
+            tag = source[start + 1]
+            end = source.find({'{': '}}', '%': '%}', '#': '#}'}[tag],
+                              start + 2)
+            if end == -1:
+                raise TemplateError('{}: unterminated tag'.format(name))
+            content = source[start + 2:end].strip()
+            pos = end + 2
+            indent = '    ' * (len(blocks) + 1)
+            if tag == '#':
+                continue
+            if tag == '{':
+                if content.endswith('|safe'):
+                    code.append(indent + 'yield str({}).encode()'.format(
+                        content[:-5]))
+                else:
+                    code.append(indent + 'yield _escape({}).encode()'.format(
+                        content))
+                continue
+            keyword = content.split(None, 1)[0] if content else ''
+            if keyword == 'args':
+                if code or blocks:
+                    raise TemplateError(
+                        '{}: args must come first'.format(name))
+                args = content[4:].strip()
+                # skip the line break after the tag
+                if source[pos:pos + 2] == '\r\n':
+                    pos += 2
+                elif source[pos:pos + 1] == '\n':
+                    pos += 1
+            elif keyword in ('if', 'for'):
+                code.append(indent + content + ':')
+                code.append(indent + '    pass')
+                blocks.append(keyword)
+            elif keyword in ('elif', 'else'):
+                if not blocks or blocks[-1] != 'if':
+                    raise TemplateError('{}: {} without if'.format(
+                        name, keyword))
+                code.append('    ' * len(blocks) + content + ':')
+                code.append(indent + 'pass')
+            elif keyword in ('endif', 'endfor'):
+                if not blocks or blocks.pop() != keyword[3:]:
+                    raise TemplateError('{}: unexpected {}'.format(
+                        name, keyword))
+            else:
+                raise TemplateError('{}: unknown tag {}'.format(name, content))
+        if blocks:
+            raise TemplateError('{}: missing end{}'.format(name, blocks[-1]))
+        namespace = {'_escape': escape}
+        exec('def render({}):\n    yield b""\n{}\n'.format(
+            args, '\n'.join(code)), namespace)
+        return namespace['render']
+
+    def generate(self, *args, **kwargs):
+        """Render the template, returning a generator that produces the
+        output as UTF-8 encoded chunks.
+
+        :param args: Positional arguments for the template.
+        :param kwargs: Keyword arguments for the template.
+        """
+        chunk = []
+        size = 0
+        for data in self.render_function(*args, **kwargs):
+            if len(data) >= self.chunk_size:
+                if chunk:
+                    yield b''.join(chunk)
+                    chunk = []
+                    size = 0
+                yield data
+                continue
+            chunk.append(data)
+            size += len(data)
+            if size >= self.chunk_size:
+                yield b''.join(chunk)
+                chunk = []
+                size = 0
+        if chunk:
+            yield b''.join(chunk)
+
+    def render(self, *args, **kwargs):
+        """Render the template, returning the output as a string.
+
+        :param args: Positional arguments for the template.
+        :param kwargs: Keyword arguments for the template.
+        """
+        return b''.join(self.generate(*args, **kwargs)).decode()
+
+    def response(self, *args, status_code=200, headers=None, **kwargs):
+        """Return a :class:`Response <microdot.Response>` that streams the
+        rendered template as an HTML page.
+
+        :param args: Positional arguments for the template.
+        :param status_code: The response's status code.
+        :param headers: Additional response headers.
+        :param kwargs: Keyword arguments for the template.
+        """
+        response_headers = {'Content-Type': 'text/html; charset=UTF-8'}
+        if headers:
+            response_headers.update(headers)
+        return Response(body=self.generate(*args, **kwargs),
+                        status_code=status_code, headers=response_headers)
@@ -1,15 +1,267 @@
+import asyncio
 import binascii
 import hashlib
+import time
 from microdot import Request, Response
 from microdot.microdot import MUTED_SOCKET_ERRORS, print_exception
 from microdot.helpers import wraps
 
+try:
+    from microdot.native import unmask_words
+except (ImportError, SyntaxError):  # pragma: no cover
+    unmask_words = None
+
+try:
+    from time import ticks_us, ticks_diff
+except ImportError:  # pragma: no cover
+    def ticks_us():
+        return int(time.perf_counter() * 1000000)
+
+    def ticks_diff(end, start):
+        return end - start
+
+try:
+    import zlib
+    zlib.decompressobj
+except (ImportError, AttributeError):  # pragma: no cover
+    zlib = None
+
+try:
+    import deflate
+    import io
+except ImportError:  # pragma: no cover
+    deflate = None
+
+#: The size of the blocks in which payloads are unmasked when native code is
+#: not available, in bytes. Must be a multiple of 4.
+UNMASK_BLOCK_SIZE = 1024
+
+
+def unmask(buf, mask):
+    """Unmask a WebSocket payload in place.
+
+    :param buf: The payload, as a ``bytearray``.
+    :param mask: The 4 byte masking key of the frame.
+
+    On MicroPython builds with the viper code emitter the payload is XORed
+    with the key one 32-bit word at a time, in native code. Elsewhere each
+    block of the payload is XORed with the repeated key as a single integer,
+    so that the loop over the words runs inside the interpreter instead of
+    once per byte in Python code.
+    """
+    if unmask_words is not None:  # pragma: no cover
+        unmask_words(buf, len(buf), mask)
+    else:
+        _unmask_blocks(buf, mask)
+
+
+def _unmask_blocks(buf, mask):
+    length = len(buf)
+    key = int.from_bytes(mask * (UNMASK_BLOCK_SIZE // 4), 'little')
+    view = memoryview(buf)
+    for start in range(0, length, UNMASK_BLOCK_SIZE):
+        n = min(UNMASK_BLOCK_SIZE, length - start)
+        if n < UNMASK_BLOCK_SIZE:
+            key &= (1 << (8 * n)) - 1
+        view[start:start + n] = (
+            int.from_bytes(view[start:start + n], 'little') ^ key).to_bytes(
+                n, 'little')
+
 
 class WebSocketError(Exception):
     """Exception raised when an error occurs in a WebSocket connection."""
     pass
 
 
+class PerMessageDeflate:
+    """The ``permessage-deflate`` WebSocket extension, which compresses the
+    payload of messages (RFC 7692).
+
+    :param server_max_window_bits: the size of the window used to compress
+                                   messages sent to the client, as a power
+                                   of 2, between 9 and 15.
+    :param client_max_window_bits: the largest window the client can use to
+                                   compress the messages it sends, as a
+                                   power of 2, between 8 and 15. Clients
+                                   that cannot limit their window to this
+                                   size are not offered compression, unless
+                                   this is 15.
+    :param server_no_context_takeover: compress each message on its own,
+                                       instead of referring to the data of
+                                       previous messages.
+    :param client_no_context_takeover: ask the client to compress each
+                                       message on its own.
+
+    The window sizes set how much memory compression uses on each
+    connection. Larger windows, and context takeover, compress repetitive
+    messages such as JSON state updates better.
+
+    Under CPython the ``zlib`` module is used. On MicroPython the
+    ``deflate`` module is used, and context takeover is not supported.
+    MicroPython builds that can decompress but not compress receive
+    compressed messages, and send messages uncompressed. When neither
+    module is available compression is not offered to clients.
+
+    Example::
+
+        from microdot.websocket import WebSocket, PerMessageDeflate
+
+        WebSocket.permessage_deflate = PerMessageDeflate(
+            server_max_window_bits=10, client_max_window_bits=10)
+    """
+    def __init__(self, server_max_window_bits=15, client_max_window_bits=15,
+                 server_no_context_takeover=False,
+                 client_no_context_takeover=False):
+        self.server_max_window_bits = server_max_window_bits
+        self.client_max_window_bits = client_max_window_bits
+        self.server_no_context_takeover = server_no_context_takeover or \
+            zlib is None
+        self.client_no_context_takeover = client_no_context_takeover or \
+            zlib is None
+        self.compressor = None
+        self.decompressor = None
+        self.pending = []
+
+    def negotiate(self, offers):
+        """Choose one of the compression settings offered by a client.
+
+        :param offers: the value of the client's ``Sec-WebSocket-Extensions``
+                       header.
+
+        The return value is a ``(extension, response)`` tuple, with a new
+        ``PerMessageDeflate`` instance for the connection and the value of
+        the ``Sec-WebSocket-Extensions`` response header, or ``None`` if
+        none of the offers can be accepted.
+        """
+        if zlib is None and deflate is None:  # pragma: no cover
+            return None
+        for offer in offers.split(','):
+            params = [param.strip() for param in offer.split(';')]
+            if params[0] == 'permessage-deflate':
+                accepted = self._accept(params[1:])
+                if accepted:
+                    return accepted
+        return None
+
+    def _accept(self, params):
+        server_bits = self.server_max_window_bits
+        client_bits = None
+        server_no_context_takeover = self.server_no_context_takeover
+        client_no_context_takeover = self.client_no_context_takeover
+        for param in params:
+            name = param.split('=', 1)[0].strip()
+            value = param[len(name) + 1:].strip().strip('"') \
+                if '=' in param else ''
+            if name == 'server_no_context_takeover':
+                server_no_context_takeover = True
+            elif name == 'client_no_context_takeover':
+                client_no_context_takeover = True
+            elif name == 'server_max_window_bits':
+                try:
+                    server_bits = min(server_bits, int(value))
+                except ValueError:
+                    return None
+            elif name == 'client_max_window_bits':
+                try:
+                    client_bits = min(self.client_max_window_bits,
+                                      int(value) if value else 15)
+                except ValueError:
+                    return None
+            else:
+                return None
+        if server_bits < 9:
+            # zlib cannot compress with a window of 256 bytes
+            return None
+        response = 'permessage-deflate'
+        if server_no_context_takeover:
+            response += '; server_no_context_takeover'
+        if client_no_context_takeover:
+            response += '; client_no_context_takeover'
+        if server_bits < 15:
+            response += '; server_max_window_bits=' + str(server_bits)
+        if client_bits is None:
+            if self.client_max_window_bits < 15:
+                return None
+            client_bits = 15
+        elif client_bits < 8:
+            return None
+        else:
+            response += '; client_max_window_bits=' + str(client_bits)
+        return PerMessageDeflate(server_bits, client_bits,
+                                 server_no_context_takeover,
+                                 client_no_context_takeover), response
+
+    def compress(self, data):
+        """Compress the payload of a message. Returns ``None`` if messages
+        cannot be compressed with this build of MicroPython."""
+        if zlib is None:  # pragma: no cover
+            if not hasattr(deflate.DeflateIO, 'write'):
+                return None
+            stream = io.BytesIO()
+            compressor = deflate.DeflateIO(stream, deflate.RAW,
+                                           self.server_max_window_bits)
+            compressor.write(data)
+            compressor.close()
+            # the stream ends with a final block, and the empty uncompressed
+            # block that must follow it is sent without its last 4 bytes
+            return stream.getvalue() + b'\x00'
+        if self.compressor is None:
+            self.compressor = zlib.compressobj(
+                zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED,
+                -self.server_max_window_bits)
+        data = self.compressor.compress(data) + \
+            self.compressor.flush(zlib.Z_SYNC_FLUSH)
+        if self.server_no_context_takeover:
+            self.compressor = None
+        return data[:-4]
+
+    def decompress(self, data, max_length=None):
+        """Decompress part of the payload of a message.
+
+        :param data: the compressed data.
+        :param max_length: the maximum number of bytes to return, or
+                           ``None`` for no limit.
+
+        Under MicroPython the data is kept until :meth:`flush` is called.
+        """
+        if zlib is None:  # pragma: no cover
+            self.pending.append(data)
+            return b''
+        if self.decompressor is None:
+            self.decompressor = zlib.decompressobj(
+                -self.client_max_window_bits)
+        return self._check_length(self.decompressor.decompress(
+            data, 0 if max_length is None else max_length + 1), max_length)
+
+    def flush(self, max_length=None):
+        """Return the rest of the payload of a message, after all its
+        compressed data was given to :meth:`decompress`.
+
+        :param max_length: the maximum number of bytes to return, or
+                           ``None`` for no limit.
+        """
+        if zlib is None:  # pragma: no cover
+            # end the stream with the 4 bytes the client removed and an
+            # empty final block
+            self.pending.append(b'\x00\x00\xff\xff\x01\x00\x00\xff\xff')
+            data = b''.join(self.pending)
+            self.pending = []
+            decompressor = deflate.DeflateIO(
+                io.BytesIO(data), deflate.RAW, self.client_max_window_bits)
+            return self._check_length(decompressor.read(
+                -1 if max_length is None else max_length + 1), max_length)
+        data = self.decompress(b'\x00\x00\xff\xff', max_length)
+        if self.client_no_context_takeover:
+            self.decompressor = None
+        return data
+
+    @staticmethod
+    def _check_length(data, max_length):
+        if max_length is not None and len(data) > max_length:
+            raise WebSocketError('Message too large')
+        return data
+
+
 class WebSocket:
     """A WebSocket connection object.
 
@@ -35,29 +287,112 @@ class WebSocket:
     #:    WebSocket.max_message_length = 4 * 1024  # up to 4KB messages
     max_message_length = -1
 
+    #: The maximum size of the fragments returned when iterating over the
+    #: result of ``receive_fragments()``, in bytes. Must be a multiple of 4.
+    fragment_size = 1024
+
+    #: Offer message compression to clients with the ``permessage-deflate``
+    #: extension, when set to a :class:`PerMessageDeflate` instance with the
+    #: compression settings. The default is ``None``, which does not compress
+    #: messages.
+    #:
+    #: Example::
+    #:
+    #:    WebSocket.permessage_deflate = PerMessageDeflate(
+    #:        server_max_window_bits=10, client_max_window_bits=10)
+    permessage_deflate = None
+
     def __init__(self, request):
         self.request = request
         self.closed = False
+        self.fragments = None
+        #: The :class:`PerMessageDeflate` extension negotiated with the
+        #: client, or ``None`` if messages are not compressed.
+        self.compression = None
 
     async def handshake(self):
         response = self._handshake_response()
-        await self.request.sock[1].awrite(
-            b'HTTP/1.1 101 Switching Protocols\r\n')
-        await self.request.sock[1].awrite(b'Upgrade: websocket\r\n')
-        await self.request.sock[1].awrite(b'Connection: Upgrade\r\n')
-        await self.request.sock[1].awrite(
-            b'Sec-WebSocket-Accept: ' + response + b'\r\n\r\n')
+        head = b'HTTP/1.1 101 Switching Protocols\r\n' \
+            b'Upgrade: websocket\r\nConnection: Upgrade\r\n' \
+            b'Sec-WebSocket-Accept: ' + response + b'\r\n'
+        offers = self.request.headers.get('Sec-WebSocket-Extensions')
+        if self.permessage_deflate is not None and offers:
+            accepted = self.permessage_deflate.negotiate(offers)
+            if accepted:
+                self.compression = accepted[0]
+                head += b'Sec-WebSocket-Extensions: ' + \
+                    accepted[1].encode() + b'\r\n'
+        await self.request.sock[1].awrite(head + b'\r\n')
 
     async def receive(self):
-        """Receive a message from the client."""
+        """Receive a message from the client.
+
+        Messages that the client sends in several frames are reassembled
+        before they are returned.
+        """
+        max_allowed_length = Request.max_body_length \
+            if self.max_message_length == -1 else self.max_message_length
         while True:
-            opcode, payload = await self._read_frame()
-            send_opcode, data = self._process_websocket_frame(opcode, payload)
-            if send_opcode:  # pragma: no cover
-                await self.send(data, send_opcode)
-            elif data:  # pragma: no branch
+            fragments = await self.receive_fragments(
+                fragment_size=0, max_length=max_allowed_length)
+            parts = []
+            async for fragment in fragments:
+                parts.append(fragment)
+            payload = parts[0] if len(parts) == 1 else b''.join(parts)
+            _, data = self._process_websocket_frame(fragments.opcode, payload)
+            if data:  # pragma: no branch
                 return data
 
+    async def receive_fragments(self, fragment_size=None, max_length=0):
+        """Receive a message from the client in fragments.
+
+        :param fragment_size: the maximum size of each fragment, in bytes,
+                              which must be a multiple of 4. If not given,
+                              the value of the :attr:`fragment_size`
+                              attribute is used. Set to 0 to receive each
+                              frame sent by the client as one fragment.
+        :param max_length: the maximum size of the message, in bytes. The
+                           default of 0 does not limit the size.
+
+        The return value is an asynchronous iterator that returns the
+        payload of the message as ``bytes`` fragments, as they arrive. This
+        allows large messages to be processed without buffering them
+        whole. The ``opcode`` attribute of the iterator tells if the message
+        is ``TEXT`` or ``BINARY``. Text messages are returned encoded as
+        UTF-8, and a character may be split between two fragments.
+
+        Example::
+
+            @app.route('/upload')
+            @with_websocket
+            async def upload(request, ws):
+                with open('trace.bin', 'wb') as f:
+                    async for fragment in await ws.receive_fragments():
+                        f.write(fragment)
+
+        Any part of the message that is not iterated over is discarded the
+        next time a message is received.
+
+        A ``ValueError`` is raised if ``fragment_size`` is not a multiple of
+        4.
+
+        Compressed messages are returned decompressed, and the
+        ``fragment_size`` limit applies to the compressed data. Under
+        MicroPython a compressed message is decompressed whole, once all
+        its frames are received.
+        """
+        if self.fragments is not None:
+            async for _ in self.fragments:  # pragma: no cover
+                pass
+        if fragment_size is None:
+            fragment_size = self.fragment_size
+        if fragment_size < 0 or fragment_size % 4:
+            # each fragment is unmasked from the start of the masking key
+            raise ValueError('fragment size must be a multiple of 4')
+        self.fragments = MessageFragments(self, fragment_size, max_length)
+        await self.fragments._next_frame()
+        return self.fragments
+
     async def send(self, data, opcode=None):
         """Send a message to the client.
 
@@ -66,10 +401,7 @@ class WebSocket:
                        is ``TEXT`` or ``BINARY`` depending on the type of the
                        data.
         """
-        frame = self._encode_websocket_frame(
-            opcode or (self.TEXT if isinstance(data, str) else self.BINARY),
-            data)
-        await self.request.sock[1].awrite(frame)
+        await self.request.sock[1].awrite(self._encode_message(data, opcode))
 
     async def close(self):
         """Close the websocket connection."""
@@ -103,8 +435,6 @@ class WebSocket:
     def _parse_frame_header(cls, header):
         fin = header[0] & 0x80
         opcode = header[0] & 0x0f
-        if fin == 0 or opcode == cls.CONT:  # pragma: no cover
-            raise WebSocketError('Continuation frames not supported')
         has_mask = header[1] & 0x80
         length = header[1] & 0x7f
         if length == 126:
@@ -126,11 +456,25 @@ class WebSocket:
             return None, None
         return None, payload
 
+    def _encode_message(self, data, opcode=None):
+        opcode = opcode or (
+            self.TEXT if isinstance(data, str) else self.BINARY)
+        compressed = False
+        if self.compression is not None and opcode in (self.TEXT,
+                                                       self.BINARY):
+            if isinstance(data, str):
+                data = data.encode()
+            payload = self.compression.compress(data)
+            if payload is not None:  # pragma: no branch
+                data = payload
+                compressed = True
+        return self._encode_websocket_frame(opcode, data, compressed)
+
     @classmethod
-    def _encode_websocket_frame(cls, opcode, payload):
+    def _encode_websocket_frame(cls, opcode, payload, compressed=False):
         frame = bytearray()
-        frame.append(0x80 | opcode)
-        if opcode == cls.TEXT:
+        frame.append(0x80 | (0x40 if compressed else 0) | opcode)
+        if isinstance(payload, str):
             payload = payload.encode()
         if len(payload) < 126:
             frame.append(len(payload))
@@ -143,27 +487,326 @@ class WebSocket:
         frame.extend(payload)
         return frame
 
-    async def _read_frame(self):
-        header = await self.request.sock[0].read(2)
-        if len(header) != 2:  # pragma: no cover
-            raise WebSocketError('Websocket connection closed')
+    async def _read_frame_header(self):
+        header = bytearray(2)
+        await self._read_into(header)
         fin, opcode, has_mask, length = self._parse_frame_header(header)
-        if length == -2:
-            length = await self.request.sock[0].read(2)
-            length = int.from_bytes(length, 'big')
-        elif length == -8:
-            length = await self.request.sock[0].read(8)
-            length = int.from_bytes(length, 'big')
-        max_allowed_length = Request.max_body_length \
-            if self.max_message_length == -1 else self.max_message_length
-        if length > max_allowed_length:
-            raise WebSocketError('Message too large')
-        if has_mask:  # pragma: no cover
-            mask = await self.request.sock[0].read(4)
-        payload = await self.request.sock[0].read(length)
+        # RSV1 marks the first frame of a compressed message
+        compressed = header[0] & 0x40
+        if header[0] & 0x30 or (compressed and (
+                self.compression is None or
+                opcode not in (self.TEXT, self.BINARY))):
+            raise WebSocketError('Invalid frame')
+        if length < 0:
+            header = bytearray(-length)
+            await self._read_into(header)
+            length = int.from_bytes(header, 'big')
+        mask = None
         if has_mask:  # pragma: no cover
-            payload = bytes(x ^ mask[i % 4] for i, x in enumerate(payload))
-        return opcode, payload
+            mask = bytearray(4)
+            await self._read_into(mask)
+        return fin, opcode, mask, length, compressed
+
+    async def _read_data_frame_header(self, continuation):
+        # control frames can arrive between the frames of a message, and are
+        # handled here
+        while True:
+            fin, opcode, mask, length, compressed = \
+                await self._read_frame_header()
+            if opcode < self.CLOSE:
+                if (opcode == self.CONT) != continuation:
+                    raise WebSocketError('Unexpected continuation frame'
+                                         if continuation else
+                                         'Expected continuation frame')
+                return fin, opcode, mask, length, compressed
+            if not fin or length > 125:
+                raise WebSocketError('Invalid control frame')
+            payload = await self._read_payload(length, mask)
+            send_opcode, data = self._process_websocket_frame(opcode, payload)
+            if send_opcode:  # pragma: no cover
+                await self.send(data, send_opcode)
+
+    async def _read_payload(self, length, mask):
+        payload = bytearray(length)
+        await self._read_into(payload)
+        if mask:  # pragma: no cover
+            unmask(payload, mask)
+        return bytes(payload)
+
+    async def _read_into(self, buf):
+        stream = self.request.sock[0]
+        if not hasattr(stream, 'readinto'):  # pragma: no cover
+            try:
+                buf[:] = await stream.readexactly(len(buf))
+            except EOFError:
+                raise WebSocketError('Websocket connection closed')
+            return
+        view = memoryview(buf)
+        pos = 0
+        while pos < len(buf):
+            n = await stream.readinto(view[pos:])
+            if not n:
+                raise WebSocketError('Websocket connection closed')
+            pos += n
+
+
+class MessageFragments:
+    """An asynchronous iterator over the fragments of a message received
+    from the client. Instances are returned by
+    :meth:`WebSocket.receive_fragments`.
+    """
+    def __init__(self, ws, fragment_size, max_length):
+        self.ws = ws
+        self.fragment_size = fragment_size
+        self.max_length = max_length
+        #: The opcode of the message, ``WebSocket.TEXT`` or
+        #: ``WebSocket.BINARY``.
+        self.opcode = None
+        #: The size of the message frames received so far, in bytes.
+        self.size = 0
+        #: ``True`` if the message is compressed.
+        self.compressed = False
+        #: The size of the message fragments returned so far, in bytes.
+        self.length = 0
+        self.fin = False
+        self.done = False
+        self.mask = None
+        self.remaining = 0
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        while True:
+            if self.remaining:
+                n = self.remaining
+                if self.fragment_size and n > self.fragment_size:
+                    # fragments start at multiples of 4 bytes in the frame,
+                    # so the masking key lines up with each of them
+                    n = self.fragment_size
+                self.remaining -= n
+                data = await self.ws._read_payload(n, self.mask)
+                if self.compressed:
+                    data = self.ws.compression.decompress(
+                        data, self._max_fragment_length())
+            elif not self.fin:
+                await self._next_frame()
+                continue
+            elif self.done:
+                raise StopAsyncIteration
+            else:
+                self.done = True
+                if not self.compressed:
+                    raise StopAsyncIteration
+                data = self.ws.compression.flush(self._max_fragment_length())
+            if data:
+                self.length += len(data)
+                return data
+
+    async def _next_frame(self):
+        self.fin, opcode, self.mask, self.remaining, compressed = \
+            await self.ws._read_data_frame_header(self.opcode is not None)
+        if self.opcode is None:
+            self.opcode = opcode
+            self.compressed = compressed
+        self.size += self.remaining
+        if self.max_length and self.size > self.max_length:
+            raise WebSocketError('Message too large')
+
+    def _max_fragment_length(self):
+        if not self.max_length:
+            return None
+        return self.max_length - self.length
+
+
+class WebSocketHub:
+    """Broadcast messages to multiple WebSocket clients.
+
+    :param max_queue: the maximum number of messages waiting to be sent to
+                      each client.
+    :param disconnect_slow_clients: when ``True``, a client that has
+                                    ``max_queue`` messages waiting when a
+                                    new message is broadcast is
+                                    disconnected. When ``False``, the oldest
+                                    message waiting for the client is
+                                    dropped.
+
+    Each message is encoded into a frame once, and queued for every client.
+    A task for each client writes its queued frames, so that a client that
+    is slow to receive does not delay the others. Clients that negotiated
+    compression receive messages compressed for them as they are sent.
+
+    Example::
+
+        hub = WebSocketHub()
+
+        @app.route('/echo')
+        @with_websocket
+        async def echo(request, ws):
+            hub.add(ws)
+            try:
+                while True:
+                    hub.broadcast(await ws.receive(), exclude=ws)
+            finally:
+                hub.remove(ws)
+    """
+    def __init__(self, max_queue=8, disconnect_slow_clients=False):
+        self.max_queue = max_queue
+        self.disconnect_slow_clients = disconnect_slow_clients
+        self.clients = {}  # websocket: (queue, event, task)
+        #: The number of messages broadcast.
+        self.broadcasts = 0
+        #: The number of messages dropped because a client fell behind.
+        self.dropped = 0
+        #: The number of clients disconnected because they fell behind.
+        self.disconnected = 0
+        #: The highest number of messages waiting for a client.
+        self.max_queue_depth = 0
+        #: The number of messages written to clients.
+        self.sent = 0
+        #: The total and highest times from the broadcast of a message to
+        #: the end of its write to a client, in microseconds.
+        self.latency_total = 0
+        self.latency_max = 0
+
+    def add(self, ws):
+        """Add a client to the hub.
+
+        :param ws: the client's WebSocket object.
+        """
+        queue = []
+        event = asyncio.Event()
+        self.clients[ws] = (queue, event, asyncio.create_task(
+            self._send_queued(ws, queue, event)))
+
+    def remove(self, ws):
+        """Remove a client from the hub. Messages that are waiting to be
+        sent to the client are discarded.
+
+        :param ws: the client's WebSocket object.
+        """
+        client = self.clients.pop(ws, None)
+        if client is not None:
+            client[2].cancel()
+
+    def broadcast(self, data, opcode=None, exclude=None):
+        """Send a message to all the clients in the hub.
+
+        :param data: the data to send, given as a string or bytes.
+        :param opcode: a custom frame opcode to use. If not given, the opcode
+                       is ``TEXT`` or ``BINARY`` depending on the type of the
+                       data.
+        :param exclude: a WebSocket object that does not receive the
+                        message, such as the client that sent it.
+        """
+        opcode = opcode or (
+            WebSocket.TEXT if isinstance(data, str) else WebSocket.BINARY)
+        if isinstance(data, str):
+            data = data.encode()
+        self.broadcasts += 1
+        frame = None
+        now = ticks_us()
+        slow_clients = []
+        for ws, (queue, event, task) in self.clients.items():
+            if ws is exclude:
+                continue
+            if len(queue) >= self.max_queue:
+                if self.disconnect_slow_clients:
+                    slow_clients.append(ws)
+                    continue
+                queue.pop(0)
+                self.dropped += 1
+            if ws.compression is None:
+                if frame is None:
+                    frame = WebSocket._encode_websocket_frame(opcode, data)
+                queue.append((frame, opcode, data, now))
+            else:
+                # compressed frames depend on the messages sent before them
+                # to the client, so they are encoded by the client's task
+                queue.append((None, opcode, data, now))
+            if len(queue) > self.max_queue_depth:
+                self.max_queue_depth = len(queue)
+            event.set()
+        for ws in slow_clients:
+            self.remove(ws)
+            self.disconnected += 1
+            # the socket is closed in a task, as MicroPython streams are only
+            # closed by aclose(), so that the client's receive() ends
+            ws.closed = True
+            asyncio.create_task(self._disconnect(ws))
+
+    @staticmethod
+    async def _disconnect(ws):
+        try:
+            await ws.request.sock[1].aclose()
+        except Exception:  # pragma: no cover
+            pass
+
+    def queue_depth(self):
+        """Return the number of messages waiting to be sent to all the
+        clients."""
+        return sum(len(queue) for queue, _, _ in self.clients.values())
+
+    def render(self):
+        """Return the hub metrics in the Prometheus text exposition format,
+        as a list of lines."""
+        return [
+            '# HELP microdot_websocket_clients Clients in the hub.',
+            '# TYPE microdot_websocket_clients gauge',
+            'microdot_websocket_clients {}'.format(len(self.clients)),
+            '# HELP microdot_websocket_broadcasts_total Messages broadcast.',
+            '# TYPE microdot_websocket_broadcasts_total counter',
+            'microdot_websocket_broadcasts_total {}'.format(self.broadcasts),
+            '# HELP microdot_websocket_queue_depth Messages waiting to be '
+            'sent.',
+            '# TYPE microdot_websocket_queue_depth gauge',
+            'microdot_websocket_queue_depth {}'.format(self.queue_depth()),
+            '# HELP microdot_websocket_max_queue_depth Most messages seen '
+            'waiting for a client.',
+            '# TYPE microdot_websocket_max_queue_depth gauge',
+            'microdot_websocket_max_queue_depth {}'.format(
+                self.max_queue_depth),
+            '# HELP microdot_websocket_dropped_total Messages dropped for '
+            'clients that fell behind.',
+            '# TYPE microdot_websocket_dropped_total counter',
+            'microdot_websocket_dropped_total {}'.format(self.dropped),
+            '# HELP microdot_websocket_disconnected_total Clients '
+            'disconnected because they fell behind.',
+            '# TYPE microdot_websocket_disconnected_total counter',
+            'microdot_websocket_disconnected_total {}'.format(
+                self.disconnected),
+            '# HELP microdot_websocket_broadcast_latency_seconds Time from '
+            'the broadcast of a message to its write to a client.',
+            '# TYPE microdot_websocket_broadcast_latency_seconds summary',
+            'microdot_websocket_broadcast_latency_seconds_sum {}'.format(
+                self.latency_total / 1000000),
+            'microdot_websocket_broadcast_latency_seconds_count {}'.format(
+                self.sent),
+            '# HELP microdot_websocket_broadcast_latency_max_seconds Highest '
+            'time from the broadcast of a message to its write to a client.',
+            '# TYPE microdot_websocket_broadcast_latency_max_seconds gauge',
+            'microdot_websocket_broadcast_latency_max_seconds {}'.format(
+                self.latency_max / 1000000),
+        ]
+
+    async def _send_queued(self, ws, queue, event):
+        try:
+            while True:
+                while not queue:
+                    await event.wait()
+                    event.clear()
+                frame, opcode, data, queued = queue.pop(0)
+                if frame is None:
+                    frame = ws._encode_message(data, opcode)
+                await ws.request.sock[1].awrite(frame)
+                latency = ticks_diff(ticks_us(), queued)
+                self.sent += 1
+                self.latency_total += latency
+                if latency > self.latency_max:
+                    self.latency_max = latency
+        except OSError:  # pragma: no cover
+            # the client disconnected, and its handler removes it
+            pass
 
 
 async def websocket_upgrade(request):
@@ -181,7 +824,14 @@ async def websocket_upgrade(request):
             while True:
                 message = await ws.receive()
                 await ws.send(message)
+
+    The connection counts against the application's
+    ``max_streaming_connections`` limit, and the upgrade is aborted with a
+    ``503`` response that has a ``Retry-After`` header when the limit is
+    reached.
     """
+    if not request.app.start_stream(request):
+        request.app.abort(503)
     ws = WebSocket(request)
     await ws.handshake()
 
@@ -7,8 +7,12 @@ $ mpremote mount . run microdot_ws_server_pico.py
 
 Built and tested with MicroPython Firmware 1.22.1 on Raspberry Pi Pico W
 """
-from microdot import Microdot, send_file
+import asyncio
+from microdot import Microdot, Response, send_file
+from microdot.bundle import StaticBundle
+from microdot.cache import StaticCache
 from microdot.websocket import with_websocket, WebSocketError                        # (1)
+from microdot.websocket import WebSocket, WebSocketHub, PerMessageDeflate
 from picowifi import connect_wifi
 from wifi_credentials import SSID, PASSWORD
 from machine import Pin, PWM
@@ -21,6 +25,11 @@ state = {
     'gpio': LED_GPIO
 }
 
+# LED level updates from Web Socket clients are applied at most once per
+# LED_UPDATE_INTERVAL_MS. When a user drags the slider, only the newest level
+# in each interval is set on the LED and broadcast to clients.
+LED_UPDATE_INTERVAL_MS = 20
+
 # Pin and PWM to control LED brightness.
 p = Pin(LED_GPIO, Pin.OUT)
 pwm = PWM(p)
@@ -55,6 +64,34 @@ else:
     # Create Microdot server instance
     app = Microdot()
 
+    # Keep small static files (like the web page) in RAM, and answer repeat
+    # requests with 304 Not Modified. Files larger than max_file_size
+    # (like jquery.min.js) are still streamed from flash.
+    Response.static_cache = StaticCache(max_size=16 * 1024, max_file_size=8 * 1024)
+
+    # Serve static files from a single bundle file, when one was created with
+    # picotools/bundle_static.py and copied to the Pico, else from the static
+    # folder. The bundle is opened once and its index is kept in RAM.
+    try:
+        static_bundle = StaticBundle('static.bundle')
+    except OSError:
+        static_bundle = None
+
+    # Limit how many requests are handled at once so a burst of clients
+    # cannot exhaust the Pico W's memory. Extra requests wait briefly for a
+    # free slot, or receive 503 Service Unavailable with a Retry-After header.
+    # Idle persistent connections do not use a slot, and each open web page's
+    # event stream or Web Socket counts against its own, separate limit.
+    app.max_concurrent_requests = 8
+    app.max_streaming_connections = 4
+
+    # Compress Web Socket messages (permessage-deflate) for browsers that
+    # support it, to send less data over WiFi. The small 1KB windows keep the
+    # memory used per connection low, and still compress the repeated JSON
+    # state messages well. Messages are sent uncompressed to other clients,
+    # and on MicroPython builds without the deflate module.
+    WebSocket.permessage_deflate = PerMessageDeflate(server_max_window_bits=10, client_max_window_bits=10)
+
     """
     RESTFul Routes
     """
@@ -67,22 +104,31 @@ else:
         if '..' in path:
             # Directory traversal is not allowed
             return 'Not found', 404
-        return send_file('static/' + path)
+        if static_bundle:
+            return static_bundle.send_file(path, request=request) or ('Not found', 404)
+        # compressed='auto' serves static/<path>.gz (if present) to browsers that
+        # accept gzip. Create the .gz files with picotools/gzip_static.py
+        return send_file('static/' + path, compressed='auto', request=request)
     
 
     # HTTP GET route to return a static version of the web page.
     # This could alternativly be written as @app.route('/', methods=['GET'])
     @app.get('/')
     async def index(request):
-        return send_file('static/index_ws_client_static.html')
+        if static_bundle:
+            return static_bundle.send_file('index_ws_client_static.html', request=request)
+        return send_file('static/index_ws_client_static.html', compressed='auto', request=request)
 
 
     """
     Web Sockets (using the Microdot Web Socket Extension)
     """
 
-    # Dictionary of connected clients so we can broadcast data to all clients.
-    websocket_clients = {}  # (host,port), web socket object.                        # (3)
+    # Hub of connected clients so we can broadcast data to all clients.
+    # Each broadcast message is encoded once and queued for every client, and
+    # a client that falls more than 8 messages behind (e.g. on a poor WiFi
+    # link) has its oldest messages dropped so it cannot slow down the others.
+    websocket_clients = WebSocketHub(max_queue=8)                                    # (3)
 
     # Web Socket entry point defined at /.
     # In Web Page (JavaScript) we connect to the Web Socket using:
@@ -97,28 +143,31 @@ else:
 
         # New client connection, store client and websocket so we can broadcast
         # to all connected clients later on.
-        websocket_clients[request.client_addr] = websocket                           # (7)
+        websocket_clients.add(websocket)                                             # (7)
         print("Client connected", request.client_addr)
-
-        # On connection, send current LED brightness and GPIO to client.
-        payload_str = dumps(state) # dictionary to JSON string                       # (8)
-        await websocket.send(payload_str)                                            # (9)
-
-        while True:                                                                  # (10)
-            try: 
-                message_str = await websocket.receive()                              # (11)
-            except WebSocketError as ex:
-                # Assume client has disconnected and break from while loop.
-                # print("WebSocketError (receive)", ex)
-                break                                                                # (12)
-
-            # Handle Web Socket client message.
-            await handle_message(request, websocket, message_str)                    # (13)
-
-        # We are now out of while True loop and can assume
-        # that client has disconnected.
-        print("Client disconnected:", request.client_addr)
-        del websocket_clients[request.client_addr]                                   # (14)
+        try:
+            # On connection, send current LED brightness and GPIO to client.
+            payload_str = dumps(state) # dictionary to JSON string                   # (8)
+            await websocket.send(payload_str)                                        # (9)
+
+            while True:                                                              # (10)
+                try: 
+                    message_str = await websocket.receive()                          # (11)
+                except WebSocketError as ex:
+                    # Assume client has disconnected and break from while loop.
+                    # print("WebSocketError (receive)", ex)
+                    break                                                            # (12)
+
+                # Handle Web Socket client message.
+                await handle_message(request, websocket, message_str)                # (13)
+
+            # We are now out of while True loop and can assume
+            # that client has disconnected.
+            print("Client disconnected:", request.client_addr)
+        finally:
+            # Also remove the client when sending or handling a message fails,
+            # so that the hub stops queueing messages for it.
+            websocket_clients.remove(websocket)                                      # (14)
 
    
     async def handle_message(request, websocket, message_str):                       # (15)
@@ -144,6 +193,57 @@ else:
             elif new_level > 100:
                 new_level = 100
 
+            # Queue the level. A newer level received before it is applied
+            # replaces it (last value wins).
+            queue_led_update(new_level, websocket)                                   # (18)
+
+
+    # The newest LED level waiting to be applied, and the client that sent it.
+    # 'websocket' is None when levels from more than one client were merged,
+    # so that every client receives the result.
+    pending_update = {'level': None, 'websocket': None}
+    led_update_event = asyncio.Event()
+    led_update_task = None
+
+    # Counters of LED level updates received from clients, applied to the LED
+    # and merged into a newer update without being applied.
+    led_update_stats = {'received': 0, 'applied': 0, 'merged': 0}
+
+
+    def queue_led_update(level, websocket):
+        """
+        Queue a new LED level to be applied by apply_led_updates().
+        """
+        global led_update_task
+
+        led_update_stats['received'] += 1
+        if pending_update['level'] is None:
+            pending_update['websocket'] = websocket
+        else:
+            led_update_stats['merged'] += 1
+            if pending_update['websocket'] is not websocket:
+                pending_update['websocket'] = None
+        pending_update['level'] = level
+
+        if led_update_task is None:
+            led_update_task = asyncio.create_task(apply_led_updates())
+        led_update_event.set()
+
+
+    async def apply_led_updates():
+        """
+        Apply the newest queued LED level, then wait LED_UPDATE_INTERVAL_MS
+        before applying the next one.
+        """
+        while True:
+            await led_update_event.wait()
+            led_update_event.clear()
+
+            new_level = pending_update['level']
+            websocket = pending_update['websocket']
+            pending_update['level'] = None
+            led_update_stats['applied'] += 1
+
             print("LED brightness level is " + str(new_level))
 
             # Store brightness in memory.
@@ -153,7 +253,9 @@ else:
             set_led_brightness(new_level)
 
             # Broadcast new state to every other connected client.
-            await broadcast_message(state, websocket)                                # (18)
+            await broadcast_message(state, websocket)
+
+            await asyncio.sleep(LED_UPDATE_INTERVAL_MS / 1000)
 
 
     async def broadcast_message(message, excludeWebsocket = None):                   # (19)
@@ -164,23 +266,27 @@ else:
 
         message_str = dumps(message) # dictionary to JSON string
 
-        # Loop through each connected Web Socket client and send payload.
-        for addr, websocket in websocket_clients.items():                            # (20)
-
-            if websocket == excludeWebsocket:                                        # (21)
-                # Not sending to 'excludeWebsocket'. We can use excludeWebsocket
-                # to prevent sending data back to the originating Web Socket
-                # client during a broadcast.
-                continue
-
-            try:
-                client_host = addr[0]
-                client_port = addr[1]                
-                print("Broadcasting {} to client {}:{}".format(message_str, client_host, client_port))
-
-                await websocket.send(message_str)                                    # (22)
-            except WebSocketError as ex:
-                print("WebSocketError (send)", ex)            
+        print("Broadcasting {} to {} clients".format(message_str, len(websocket_clients.clients)))
+
+        # Queue the payload for each connected Web Socket client. We can use
+        # excludeWebsocket to prevent sending data back to the originating
+        # Web Socket client during a broadcast.
+        websocket_clients.broadcast(message_str, exclude=excludeWebsocket)           # (20)
+
+
+    # HTTP GET route to return broadcast metrics, such as queue depth and
+    # latency, and LED update counters in the Prometheus text format.
+    @app.get('/metrics')
+    async def metrics(request):
+        lines = websocket_clients.render()
+        for name, count in led_update_stats.items():
+            lines += [
+                '# HELP led_updates_{}_total LED level updates {}.'.format(name, name),
+                '# TYPE led_updates_{}_total counter'.format(name),
+                'led_updates_{}_total {}'.format(name, count),
+            ]
+        return Response('\n'.join(lines) + '\n',
+                        headers={'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'})
 
 
     app.run(host=ip, debug=True)
@@ -0,0 +1,113 @@
+"""
+Pack a static web folder into a single bundle file for Microdot.
+
+The bundle is served on the Pico with microdot.bundle.StaticBundle, which
+keeps one file open and finds each asset in an index held in RAM, instead of
+opening a separate file on the Pico's filesystem for every request.
+
+Bundle layout:
+
+    b'MDB1'                  magic
+    4 bytes                  length of the index, big endian
+    index                    JSON list of [name, offset, length, content type,
+                             ETag, gzip flag] records. Offsets are relative
+                             to the end of the index.
+    data                     the contents of the files
+
+A gzip compressed copy of each file is also stored, with the gzip flag set,
+when it is smaller than the original.
+
+Run with Python on your computer, then copy the bundle file to the Pico.
+With no arguments the static folders for Chapter 3 and Chapter 4 are packed
+into a static.bundle file in each chapter's pico folder.
+
+$ python3 bundle_static.py [folder bundle_file]
+"""
+import binascii
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import struct
+import sys
+
+MAGIC = b'MDB1'
+
+# Default (static folder, bundle file) pairs, relative to this file.
+BUNDLES = [
+    (os.path.join('..', 'chapter03', 'pico', 'static'),
+     os.path.join('..', 'chapter03', 'pico', 'static.bundle')),
+    (os.path.join('..', 'chapter04', 'pico', 'static'),
+     os.path.join('..', 'chapter04', 'pico', 'static.bundle')),
+]
+
+
+def make_etag(data):
+    """ Strong ETag, in the same format as microdot.cache.make_etag. """
+    return '"' + binascii.hexlify(hashlib.sha1(data).digest()[:8]).decode() + '"'
+
+
+def content_type(name):
+    if name.endswith('.js'):
+        # Match the type Microdot uses for send_file.
+        return 'application/javascript'
+    return mimetypes.guess_type(name)[0] or 'application/octet-stream'
+
+
+def build_bundle(folder, bundle_file):
+    """ Pack every file in folder and its sub-folders into bundle_file. """
+
+    index = []
+    blobs = []
+    offset = 0
+
+    for root, dirs, files in os.walk(folder):
+        dirs.sort()
+        for filename in sorted(files):
+            if filename.endswith('.gz'):
+                continue
+
+            path = os.path.join(root, filename)
+            name = os.path.relpath(path, folder).replace(os.sep, '/')
+            with open(path, 'rb') as f:
+                data = f.read()
+
+            variants = [(data, 0)]
+            # mtime=0 keeps the output (and its ETag) the same between builds.
+            compressed = gzip.compress(data, compresslevel=9, mtime=0)
+            if len(compressed) < len(data):
+                variants.append((compressed, 1))
+
+            for blob, gzip_flag in variants:
+                index.append([name, offset, len(blob), content_type(name), make_etag(blob), gzip_flag])
+                blobs.append(blob)
+                offset += len(blob)
+
+            print(f"{name}: {len(data)} bytes" + (f", gzip {len(compressed)} bytes" if len(variants) > 1 else ""))
+
+    header = json.dumps(index, separators=(',', ':')).encode()
+
+    with open(bundle_file, 'wb') as f:
+        f.write(MAGIC)
+        f.write(struct.pack('>I', len(header)))
+        f.write(header)
+        for blob in blobs:
+            f.write(blob)
+
+    print(f"{bundle_file}: {len(index)} entries, {8 + len(header) + offset} bytes")
+
+
+if __name__ == '__main__':
+    if len(sys.argv) == 3:
+        bundles = [(sys.argv[1], sys.argv[2])]
+    elif len(sys.argv) == 1:
+        here = os.path.dirname(os.path.abspath(__file__))
+        bundles = [(os.path.normpath(os.path.join(here, folder)), os.path.normpath(os.path.join(here, bundle_file)))
+                   for folder, bundle_file in BUNDLES]
+    else:
+        print(__doc__)
+        sys.exit(1)
+
+    for folder, bundle_file in bundles:
+        build_bundle(folder, bundle_file)
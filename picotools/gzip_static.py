@@ -0,0 +1,69 @@
+"""
+Precompress static web files for Microdot.
+
+Creates a gzip compressed copy (with a .gz extension) of every file in the
+given folders, so that Microdot's send_file(..., compressed='auto') can
+serve the smaller file to browsers that accept gzip. Files that do not get
+smaller when compressed are skipped.
+
+Run with Python on your computer before copying the static folder to the Pico.
+With no arguments the static folders for Chapter 3 and Chapter 4 are
+compressed.
+
+$ python3 gzip_static.py [folder ...]
+"""
+import gzip
+import os
+import sys
+
+# Default folders, relative to this file.
+STATIC_FOLDERS = [
+    os.path.join('..', 'chapter03', 'pico', 'static'),
+    os.path.join('..', 'chapter04', 'pico', 'static'),
+]
+
+
+def gzip_file(path):
+    """ Write path + '.gz'. Returns (original size, compressed size) or None if skipped. """
+
+    with open(path, 'rb') as f:
+        data = f.read()
+
+    # mtime=0 keeps the output (and its ETag) the same between builds.
+    compressed = gzip.compress(data, compresslevel=9, mtime=0)
+
+    if len(compressed) >= len(data):
+        # No gain, remove any stale compressed copy.
+        if os.path.exists(path + '.gz'):
+            os.remove(path + '.gz')
+        return None
+
+    with open(path + '.gz', 'wb') as f:
+        f.write(compressed)
+
+    return len(data), len(compressed)
+
+
+def gzip_folder(folder):
+    """ Compress every file in folder and its sub-folders. """
+
+    for root, dirs, files in os.walk(folder):
+        for name in sorted(files):
+            if name.endswith('.gz'):
+                continue
+
+            path = os.path.join(root, name)
+            sizes = gzip_file(path)
+
+            if sizes:
+                print(f"{path}: {sizes[0]} -> {sizes[1]} bytes ({sizes[0] / sizes[1]:.1f}x)")
+            else:
+                print(f"{path}: skipped, does not compress")
+
+
+if __name__ == '__main__':
+    folders = sys.argv[1:] or [os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), folder))
+                               for folder in STATIC_FOLDERS]
+
+    for folder in folders:
+        gzip_folder(folder)